@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio counterpart of DotStrip, for control services built on an event loop.
+
+Shapes draw on an AsyncDotStrip as on any strip. Sends write into the
+transport without blocking and then wait only while its write buffer is
+above the high-water mark, so many strips can be driven from one thread:
+
+    strips = [await AsyncDotStrip.connect(host, port, 1091)
+              for host in hosts]
+    await asyncio.gather(*[strip.send() for strip in strips])
+"""
+import asyncio
+
+from _led import DotStrip
+
+
+class _StreamClient(object):
+    """Gives an asyncio stream the client interface DotStrip writes to"""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+
+    def sendall(self, data):
+        # asyncio may queue the object it is given, and frames are reused
+        self._writer.write(bytes(data))
+
+
+    async def drain(self):
+        await self._writer.drain()
+
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+class _DatagramClient(asyncio.DatagramProtocol):
+    """Gives a datagram endpoint the client interface DotStrip writes to"""
+
+    def __init__(self):
+        self._transport = None
+        self._error = None
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+
+    def error_received(self, exc):
+        self._error = exc
+
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+
+    def resume_writing(self):
+        self._can_write.set()
+
+
+    def sendmsg(self, buffers):
+        self._transport.sendto(b''.join(buffers))
+
+
+    async def drain(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        await self._can_write.wait()
+
+
+    async def close(self):
+        self._transport.close()
+
+
+class AsyncDotStrip(DotStrip):
+    """DotStrip whose sends are awaited on an asyncio event loop
+
+    Make one with ``connect``. Drawing is as for DotStrip. The background
+    sender of ``start_sender`` is not used; await ``send`` instead. Player,
+    FrameLog.replay and StripGroup do not await sends, so they refuse this
+    strip; use ``play`` and ``asyncio.gather`` instead.
+    """
+
+    _async = True
+
+    @classmethod
+    async def connect(cls, host, port, n_leds, protocol='tcp',
+                      high_water=None, **kwargs):
+        """Open a connection and make a strip that sends over it
+
+        Parameters
+        ----------
+        host : str
+            Address of the Raspberry Pi.
+        port : int
+            Port it listens on.
+        n_leds : int
+            Number of LEDs in the strip.
+        protocol : str
+            'tcp' to use an asyncio stream, or 'udp' for a datagram
+            endpoint, as for DotStrip.
+        high_water : int | None
+            Bytes queued in the transport above which sends wait for it to
+            drain. If None, asyncio's default.
+        **kwargs
+            Other DotStrip parameters.
+        Returns
+        -------
+        strip : instance of AsyncDotStrip
+            The connected strip.
+        """
+        if protocol == 'tcp':
+            reader, writer = await asyncio.open_connection(host, port)
+            client = _StreamClient(reader, writer)
+            transport = writer.transport
+        elif protocol == 'udp':
+            loop = asyncio.get_running_loop()
+            transport, client = await loop.create_datagram_endpoint(
+                _DatagramClient, remote_addr=(host, port))
+        else:
+            raise ValueError('protocol must be "tcp" or "udp"')
+        if high_water is not None:
+            transport.set_write_buffer_limits(high=high_water)
+        return cls(client, n_leds, protocol=protocol, **kwargs)
+
+
+    def start_sender(self, rate=None):
+        raise RuntimeError('AsyncDotStrip sends on the event loop, await '
+                           'send instead')
+
+
+    async def send(self):
+        """Send the strip, waiting while the transport is backed up"""
+        DotStrip.send(self)
+        await self._client.drain()
+
+
+    async def send_frame(self, frames, idx):
+        """Send one pre-encoded frame, as for ``DotStrip.send_frame``"""
+        DotStrip.send_frame(self, frames, idx)
+        await self._client.drain()
+
+
+    async def play(self, frames, rate=None):
+        """Send frames in turn, yielding the index of each once it is sent
+
+        Parameters
+        ----------
+        frames : instance of FrameSequence | FrameLog
+            Frames encoded for this strip.
+        rate : float | None
+            Frames per second, kept to absolute deadlines on the event loop
+            clock. If None, frames are sent as fast as the link drains.
+
+        Yields
+        ------
+        idx : int
+            Index of the frame just sent. Use as::
+
+                async for idx in strip.play(frames, 100.):
+                    ...
+        """
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        for idx in range(len(frames)):
+            if rate is not None:
+                await asyncio.sleep(max(t0 + idx / rate - loop.time(), 0))
+            await self.send_frame(frames, idx)
+            yield idx
+
+
+    async def close(self):
+        """Close the connection"""
+        self.stop_recording()
+        await self._client.close()
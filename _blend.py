@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Blend kernels for compositing RGBA colors onto the LED buffer.
+
+Every kernel works in place on ``dst``, a slice of ``DotStrip._colors``,
+with ``src`` the colors of the shape being drawn. Both are N x 4 RGBA,
+either floats where 1 is full scale, or unsigned fixed-point integers where
+the largest value of the type is full scale.
+"""
+import threading
+
+import numpy as np
+from expyfun._utils import logger
+
+_scratch = threading.local()
+
+
+def _get_scratch(shape, dtype):
+    """Scratch array reused across calls, one per thread and dtype"""
+    try:
+        bufs = _scratch.bufs
+    except AttributeError:
+        bufs = _scratch.bufs = dict()
+    size = shape[0] * shape[1]
+    buf = bufs.get(dtype)
+    if buf is None or buf.size < size:
+        buf = bufs[dtype] = np.empty(size, dtype=dtype)
+    return buf[:size].reshape(shape)
+
+
+def _add(dst, src):
+    np.add(dst, src, out=dst)
+    if len(dst) and dst.max() > 1:
+        logger.warning('Buffer values exceed 1. Color distortion may occur.')
+
+
+def _max(dst, src):
+    np.copyto(dst, src, where=src[:, -1:] > dst[:, -1:])
+
+
+def _occlude(dst, src):
+    np.copyto(dst, src, where=src[:, -1:] > 0)
+
+
+def _over(dst, src):
+    src_alpha = src[:, -1:]
+    dst_alpha = dst[:, -1:]
+    dst_colors = dst[:, :-1]
+    tmp = _get_scratch(dst.shape, dst.dtype)
+    lit = _get_scratch(dst_alpha.shape, bool)
+    np.subtract(1, src_alpha, out=tmp[:, -1:])
+    np.multiply(dst_alpha, tmp[:, -1:], out=dst_alpha)
+    np.multiply(dst_colors, dst_alpha, out=dst_colors)
+    np.multiply(src[:, :-1], src_alpha, out=tmp[:, :-1])
+    np.add(dst_colors, tmp[:, :-1], out=dst_colors)
+    np.add(dst_alpha, src_alpha, out=dst_alpha)
+    np.greater(dst_alpha, 0, out=lit)
+    np.divide(dst_colors, dst_alpha, out=dst_colors, where=lit)
+
+
+def _multiply(dst, src):
+    np.multiply(dst, src, out=dst)
+
+
+def _screen(dst, src):
+    prod = _get_scratch(dst.shape, dst.dtype)
+    np.multiply(dst, src, out=prod)
+    np.add(dst, src, out=dst)
+    np.subtract(dst, prod, out=dst)
+
+
+def to_dtype(colors, dtype):
+    """Convert float colors to the dtype of a color buffer
+
+    Fixed-point colors are clipped to full scale and rounded.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return np.asarray(colors, dtype=dtype)
+    if dtype.kind != 'u':
+        raise ValueError('Color buffers must be float or unsigned int, got %s'
+                         % dtype)
+    colors = np.asarray(colors)
+    if colors.dtype == dtype:
+        return colors
+    full = np.iinfo(dtype).max
+    return np.round(np.clip(colors, 0, 1) * full).astype(dtype)
+
+
+def _fixed_add(dst, src):
+    room = np.iinfo(dst.dtype).max - src
+    if np.any(dst > room):
+        logger.warning('Buffer values exceed 1. Color distortion may occur.')
+        np.minimum(dst, room, out=dst)
+    np.add(dst, src, out=dst)
+
+
+def _fixed_over(dst, src):
+    full = np.iinfo(dst.dtype).max
+    src_alpha = src[:, -1:].astype(np.int64)
+    # alpha and colors are kept at full ** 2 and full ** 3 scale until the end
+    dst_weight = dst[:, -1:] * (full - src_alpha)
+    alpha = src_alpha * full + dst_weight
+    colors = src[:, :-1] * (src_alpha * full) + dst[:, :-1] * dst_weight
+    np.floor_divide(colors + alpha // 2, alpha, out=colors, where=alpha > 0)
+    colors[np.broadcast_to(alpha == 0, colors.shape)] = 0
+    dst[:, :-1] = colors
+    dst[:, -1:] = (alpha + full // 2) // full
+
+
+def _fixed_multiply(dst, src):
+    full = np.iinfo(dst.dtype).max
+    prod = dst.astype(np.int64) * src
+    dst[:] = (prod + full // 2) // full
+
+
+def _fixed_screen(dst, src):
+    full = np.iinfo(dst.dtype).max
+    prod = (dst.astype(np.int64) * src + full // 2) // full
+    np.add(dst, src - prod.astype(dst.dtype), out=dst)
+
+
+BLEND_MODES = dict(add=_add, max=_max, occlude=_occlude, over=_over,
+                   multiply=_multiply, screen=_screen)
+FIXED_BLEND_MODES = dict(add=_fixed_add, max=_max, occlude=_occlude,
+                         over=_fixed_over, multiply=_fixed_multiply,
+                         screen=_fixed_screen)
+
+
+def blend(dst, src, blend_mode='add'):
+    """Composite src onto dst in place
+
+    Parameters
+    ----------
+    dst : N x 4 array
+        Colors to draw onto, modified in place.
+    src : N x 4 array
+        Colors being drawn.
+    blend_mode : str
+        'add' : add translucent object on top of existing objects
+        'max' : show whichever object is brighter
+        'occlude' : add opaque object on top of existing objects
+        'over' : alpha-composite the object over existing objects
+        'multiply' : multiply existing objects by the object
+        'screen' : brighten existing objects by the object
+    """
+    if blend_mode not in BLEND_MODES:
+        raise ValueError('blend_mode must be one of %s, got %r'
+                         % (sorted(BLEND_MODES), blend_mode))
+    if dst.dtype.kind == 'u':
+        FIXED_BLEND_MODES[blend_mode](dst, src)
+    else:
+        BLEND_MODES[blend_mode](dst, src)
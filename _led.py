@@ -5,11 +5,196 @@ Created on Fri May 31 09:27:18 2019
 
 @author: maddy
 """
+from contextlib import contextmanager
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import os
+import sys
+import threading
+import time
 import numpy as np
-from expyfun._utils import logger
-import warnings
 
-class DotStrip:
+from _blend import blend, to_dtype
+from _protocol import (iter_segments, pack_keyframe, pack_delta,
+                       MESSAGE_HEADER, COMPRESSIONS)
+
+# 8-bit gamma curve applied to premultiplied colors before quantization
+_GAMMA = np.array([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                   0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                   0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
+                   1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 3, 3, 3,
+                   3, 3, 3, 3, 4, 4, 4, 4, 4, 5, 5, 5, 5,
+                   6, 6, 6, 6, 7, 7, 7, 7, 8, 8, 8, 9, 9,
+                   9, 10, 10, 10, 11, 11, 11, 12, 12, 13, 13, 13, 
+                   14, 14, 15, 15, 16, 16, 17, 17, 18, 18, 19, 19, 
+                   20, 20, 21, 21, 22, 22, 23, 24, 24, 25, 25, 26,
+                   27, 27, 28, 29, 29, 30, 31, 32, 32, 33, 34, 35, 
+                   35, 36, 37, 38, 39, 39, 40, 41, 42, 43, 44, 45, 
+                   46, 47, 48, 49, 50, 50, 51, 52, 54, 55, 56, 57, 
+                   58, 59, 60, 61, 62, 63, 64, 66, 67, 68, 69, 70, 
+                   72, 73, 74, 75, 77, 78, 79, 81, 82, 83, 85, 86, 
+                   87, 89, 90, 92, 93, 95, 96, 98, 99, 101, 102, 104, 
+                   105, 107, 109, 110, 112, 114, 115, 117, 119, 120, 
+                   122, 124, 126, 127, 129, 131, 133, 135, 137, 138, 
+                   140, 142, 144, 146, 148, 150, 152, 154, 156, 158, 
+                   160, 162, 164, 167, 169, 171, 173, 175, 177, 180, 
+                   182, 184, 186, 189, 191, 193, 196, 198, 200, 203,
+                   205, 208, 210, 213, 215, 218, 220, 223, 225, 228,
+                   231, 233, 236, 239, 241, 244, 247, 249, 252, 255], dtype=np.uint8)
+
+_encoding_tables = dict()
+
+
+def _get_encoding_tables(gamma):
+    """Get cached APA102 lookup tables for a 256-entry gamma curve
+
+    Parameters
+    ----------
+    gamma : array of 256 ints
+        Monotonic map from quantized premultiplied color (0-255) to output
+        level (0-255).
+
+    Returns
+    -------
+    bright : array, shape (256,)
+        Brightness byte indexed by the largest quantized channel of a pixel.
+    chans : array, shape (256, 256)
+        Channel byte indexed by the largest quantized channel of a pixel and
+        by the quantized channel itself.
+    """
+    gamma = np.asarray(gamma)
+    if gamma.shape != (256,):
+        raise ValueError('gamma must have 256 entries')
+    if gamma.min() < 0 or gamma.max() > 255 or np.any(np.diff(gamma) < 0):
+        raise ValueError('gamma must be non-decreasing between 0 and 255')
+    key = gamma.astype(np.uint8).tobytes()
+    if key not in _encoding_tables:
+        levels = gamma.astype(np.float64)
+        c_max = 255
+        g_max = 2 ** 5 - 2
+        g = np.ceil(levels * g_max / c_max)
+        chans = np.zeros((256, 256))
+        np.divide(levels[np.newaxis], g[:, np.newaxis], out=chans,
+                  where=g[:, np.newaxis] > 0)
+        bright = (g + 0xE0).astype(np.uint8)
+        chans = np.round(chans).astype(np.uint8)
+        bright.flags.writeable = False
+        chans.flags.writeable = False
+        _encoding_tables[key] = (bright, chans)
+    return _encoding_tables[key]
+
+
+_get_encoding_tables(_GAMMA)
+
+
+def _check_blocking(led, caller):
+    """Refuse strips whose sends would return un-awaited coroutines"""
+    if getattr(led, '_async', False):
+        raise ValueError('%s sends without awaiting, so it cannot use an '
+                         'AsyncDotStrip' % caller)
+
+
+def _merge_ranges(ranges, gap=0):
+    """Sort and merge (start, stop) ranges that are at most gap apart"""
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], stop)
+        elif stop > start:
+            merged.append([start, stop])
+    return merged
+
+
+class _Positioned(object):
+    """Super class for LED objects addressable in degrees azimuth"""
+
+    default_calibration = np.array([[246, 58], [493, 10],
+                                    [740, -38], [1008, -90]])
+
+    def _set_calibration(self, calibration, kind, offset):
+        self._offset = offset
+        if calibration is None:
+            calibration = self.default_calibration
+        if isinstance(calibration, str):
+            calibration = np.loadtxt(calibration, ndmin=2, usecols=(0, 1))
+        calibration = np.asarray(calibration, dtype=np.float64)
+        self._calibration = _Calibration(
+            calibration[:, 0], calibration[:, 1] + (2 if offset else 0), kind)
+
+
+    def convert_units(self, pos, fro, to):
+        """Convert units of LED index to degrees azimuth
+        
+        Parameters
+        ----------
+        pos : int or float or array
+            positions in either int or deg
+        fro : str
+            the units of pos -- either 'ind' or 'deg'
+        to : str
+            the desired units -- either 'ind' or 'deg'
+        Returns
+        -------
+        pos : array
+            converted positions, with at least one dimension
+        """
+        pos = np.atleast_1d(np.asarray(pos, dtype=np.float64))
+        if fro == 'ind' and to == 'deg':
+            return self._calibration.to_deg(pos)
+        elif fro == 'deg' and to == 'ind':
+            return self._calibration.to_ind(pos)
+        else:
+            raise ValueError('fro and to must be "ind" and "deg", "deg"'
+                             'and "ind" or "deg"')
+    
+    def get_nearest_speaker(self, azimuth, units):
+        """Get the index of the speaker nearest to positions on the strip
+
+        Parameters
+        ----------
+        azimuth : int or float or array
+            positions in either 'ind' or 'deg'
+        units : str
+            the units of azimuth -- either 'ind' or 'deg'
+        Returns
+        -------
+        speaker_ind : int or array of int
+            speaker indices, an array if azimuth is one
+        """
+        scalar = np.ndim(azimuth) == 0
+        azimuth = np.asarray(azimuth, dtype=np.float64)
+        if units == 'ind':
+            azimuth = self.convert_units(azimuth, 'ind', 'deg')
+        if units == 'deg' and self._offset:
+            azimuth = azimuth - 2
+        speaker_ind = np.trunc(azimuth / 4 + 26).astype(int)
+        return int(speaker_ind.ravel()[0]) if scalar else speaker_ind
+    
+    def get_speaker_location(self, speaker_ind, to_units):
+        """Get the position of speakers on the strip
+
+        Parameters
+        ----------
+        speaker_ind : int or array of int
+            speaker indices
+        to_units : str
+            the desired units -- either 'ind' or 'deg'
+        Returns
+        -------
+        azimuth : int or array
+            speaker positions, always an array for 'ind'
+        """
+        if np.ndim(speaker_ind):
+            speaker_ind = np.asarray(speaker_ind)
+        azimuth = (speaker_ind - 26) * 4
+        if to_units == 'ind':
+            azimuth = self.convert_units(azimuth, 'deg', 'ind')
+        return azimuth
+
+
+class DotStrip(_Positioned):
     """Object for using LED DotStrip
     
     Parameters
@@ -28,14 +213,59 @@ class DotStrip:
     n_leds : int
         Number of LEDs in the strip
     packet_size : int
-        Number of floats to send in each OSC message -- must be lower than 1634
+        Number of frame bytes to send in each UDP packet -- must be lower
+        than 1634
+    offset : bool
+        If True, shift the calibration by 2 degrees.
+    gamma : array of 256 ints | None
+        Gamma curve used when encoding colors. If None, use
+        ``DotStrip.default_gamma``.
+    deferred : bool
+        If True, drawing only composites colors and the frame is encoded
+        once, when it is sent or ``buffer`` is read. If False, every draw
+        re-encodes the frame immediately.
+    calibration : str | array, shape (n_points, 2) | None
+        LED index and azimuth in degrees of calibration points, or a text
+        file with those two columns. If None, use the default rig points.
+    calibration_kind : str
+        'linear' or 'piecewise' mapping through the calibration points.
+    dtype : dtype
+        Type of the color buffers of the strip and of its shapes. Floats
+        are full scale at 1. np.uint8 or np.uint16 store fixed-point colors,
+        full scale at the type's maximum, which take 8 or 4 times less
+        memory and are blended and encoded with integer arithmetic. Their
+        rounding can move an LED's 5-bit brightness by one step, which
+        changes its color bytes by up to 4. With np.uint8 this affects
+        about 2% of the bytes of random colors, with np.uint16 under 0.01%.
+    protocol : str
+        'tcp' to stream frames with ``client.sendall``, or 'udp' to split
+        each frame into numbered packets sent with ``client.sendmsg``. For
+        'udp' the client must be a connected datagram socket.
+    keyframe_interval : int | None
+        If not None, frames are sent as framed messages holding only the
+        bytes that changed since the previous frame, with the whole frame
+        sent every ``keyframe_interval`` frames. The receiver must decode
+        these messages.
+    compression : str | None
+        If not None, frames are sent as framed messages, with each keyframe
+        compressed when that makes it smaller. 'rle' sends only the runs of
+        LEDs that are not dark, for a few shapes on a long strip. 'zlib'
+        deflates the frame at level 1. The receiver must decode these
+        messages.
     Returns
     -------
     dotstrip : instance of DotStrip
         The dotstrip object.
     """
 
-    def __init__(self, client, n_leds, offset=False, packet_size=1500):
+    default_gamma = _GAMMA
+    # True for strips whose sends are coroutines that must be awaited
+    _async = False
+
+    def __init__(self, client, n_leds, offset=False, packet_size=1500,
+                 gamma=None, deferred=False, calibration=None,
+                 calibration_kind='linear', dtype=np.float64, protocol='tcp',
+                 keyframe_interval=None, compression=None):
         if not isinstance(n_leds, int):
             raise ValueError('n_leds must be type int')
         if not isinstance(packet_size, int):
@@ -43,136 +273,1015 @@ class DotStrip:
         self._n_leds = n_leds
         if packet_size > 1634:
             raise ValueError('packet_size must be less than 1634')
+        if packet_size < 1:
+            raise ValueError('packet_size must be positive')
+        if protocol not in ('tcp', 'udp'):
+            raise ValueError('protocol must be "tcp" or "udp"')
+        dtype = np.dtype(dtype)
+        if dtype.kind != 'f' and dtype not in (np.uint8, np.uint16):
+            raise ValueError('dtype must be a float type, np.uint8 or '
+                             'np.uint16')
+        if keyframe_interval is not None and keyframe_interval < 1:
+            raise ValueError('keyframe_interval must be at least 1')
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError('compression must be one of %s or None'
+                             % (COMPRESSIONS,))
         self._client = client
-        self._colors = np.zeros((n_leds, 4))
-        self._pre_buffer = np.zeros((n_leds, 4))
-        self._buffer = self._make_bytes(self._colors)
+        self.set_gamma(gamma)
+        self._colors = np.zeros((n_leds, 4), dtype=dtype)
+        self._pre_buffer = np.zeros((n_leds, 4)) if dtype.kind == 'f' else None
+        # start frame, one 4-byte word per LED, then the end frame
+        n_end = int(np.ceil((n_leds / 2. + 1) / 8.))
+        self._buffer = np.zeros(4 + 4 * n_leds + n_end, dtype=np.uint8)
+        self._pixels = self._buffer[4:4 + 4 * n_leds].reshape(n_leds, 4)
+        self._view = memoryview(self._buffer)
+        self._deferred = deferred
+        self._make_bytes(self._colors)
+        self._stale = False
+        # LED ranges changed since the last encode, and since the last clear
+        self._dirty = []
+        self._lit = []
+        # the number of UDP segments is worked out per message, as framed
+        # messages vary in length
         self._packet_size = packet_size
-        self._n_segments = int(np.ceil(len(self._buffer) / self._packet_size))
-        self._tcp = False
-        self._offset = offset
+        self._tcp = protocol == 'tcp'
+        self._n_frames = 0
+        self._keyframe_interval = keyframe_interval
+        self._compression = compression
+        self._framed = (keyframe_interval is not None or
+                        compression is not None)
+        self._last_sent = None
+        self._last_key = 0
+        self._set_calibration(calibration, calibration_kind, offset)
+        self._timer = None
+        self._sender = None
+        self._recorder = None
+        self._shared = None
+        self._shared_seq = 0
+        self._n_sent = 0
+        self._n_dropped = 0
 
 
-    def _make_pixel(self, colors):
-        
-        colors = np.array(colors, dtype=np.float64)
+    def __getstate__(self):
+        # pickled strips, e.g. sent to render workers, can draw and encode
+        # but not send
+        state = self.__dict__.copy()
+        for name in ('_pixels', '_view', '_last_sent'):
+            del state[name]
+        state.update(_client=None, _sender=None, _timer=None, _recorder=None,
+                     _shared=None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        n_leds = self._n_leds
+        self._pixels = self._buffer[4:4 + 4 * n_leds].reshape(n_leds, 4)
+        self._view = memoryview(self._buffer)
+        self._last_sent = None
+
+
+    def _make_pixel(self, colors, out=None):
+        """Encode colors as APA102 words of brightness, blue, green, red"""
+        colors = np.asarray(colors)
+        if colors.dtype.kind != 'u':
+            colors = colors.astype(np.float64, copy=False)
         if colors.shape[-1] not in [3, 4]:
             raise ValueError('Must specify RGB or RGBA value')
         if colors.shape[-1] == 3:
-            colors = np.concatenate((colors, np.ones((self.n_leds, 1))), 0)
+            colors = np.concatenate((colors, np.ones((len(colors), 1))), 1)
         assert(colors.shape[-1] == 4)
+        if out is None:
+            out = np.empty((len(colors), 4), dtype=np.uint8)
 
-        colors = colors[:, :3] * colors[:, 3][:, np.newaxis]
-        colors = self._gamma_correct(colors)
-        c_max = 255
-        g_max = 2 ** 5 - 2
-        
-        g = np.ceil(colors[:, :3].max(1) * g_max / c_max).astype(np.uint8)
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            c = np.round(colors / g[:, np.newaxis]).astype(np.uint8)
-
-        bright = np.uint8(g + int('11100000', 2))
-        colors = np.concatenate((bright[:, np.newaxis], 
-                                 np.fliplr(np.uint8(c))), 1)                            
-        colors = list(colors.ravel())
-        return colors
+        if colors.dtype.kind == 'u':
+            # premultiply in integers, rounding up like the float path
+            scale = np.iinfo(colors.dtype).max ** 2 // 255
+            q = colors[:, :3].astype(np.int64) * colors[:, 3:]
+            q += scale - 1
+            q //= scale
+        else:
+            colors = colors[:, :3] * colors[:, 3][:, np.newaxis]
+            q = np.ceil(colors * 255).astype(np.intp)
+        q_max = q.max(1)
+        bright, chans = self._tables
+        np.take(bright, q_max, out=out[:, 0])
+        out[:, 1:] = chans[q_max[:, np.newaxis], q[:, ::-1]]
+        return out
 
 
     def _make_bytes(self, colors):
-        start = [np.uint8(0)] * 4
-        end = [np.uint8(0)] * int(np.ceil((len(colors) / 2. + 1) / 8.))
+        """Encode colors into the preallocated frame buffer"""
+        self._make_pixel(colors, self._pixels)
+        return self._buffer
 
-        pixels = []
-        pixels = self._make_pixel(colors)
-        self._buffer = start + pixels + end
-        return start + pixels + end
 
+    def set_gamma(self, gamma=None):
+        """Set the gamma curve used to encode colors
+
+        Parameters
+        ----------
+        gamma : array of 256 ints | None
+            Non-decreasing map from quantized color (0-255) to output level
+            (0-255). If None, use ``DotStrip.default_gamma``. Lookup tables
+            are cached per curve, so switching back and forth is cheap.
+        """
+        if gamma is None:
+            gamma = self.default_gamma
+        self._tables = _get_encoding_tables(gamma)
+        # every LED is re-encoded with the new curve, unless called from
+        # __init__ before the buffers exist
+        if hasattr(self, '_dirty'):
+            self._dirty.append((0, self._n_leds))
+            self._stale = True
+
+
+    def _update(self, start=0, stop=None):
+        """Encode changed colors now, or mark them for deferred mode
+
+        Parameters
+        ----------
+        start, stop : int | None
+            Range of LEDs that changed. By default, the whole strip.
+        """
+        if stop is None:
+            stop = self._n_leds
+        self._dirty.append((start, stop))
+        self._lit.append((start, stop))
+        if len(self._lit) > 32:
+            self._lit = [tuple(r) for r in _merge_ranges(self._lit)]
+        if self._deferred:
+            self._stale = True
+        else:
+            self._encode()
+
+
+    def mark_dirty(self, start=0, stop=None):
+        """Flag LEDs whose colors were written directly into the buffer
+
+        Drawing shapes and clearing the strip track what they change, but
+        writes to ``_colors`` must be flagged so they get encoded.
+
+        Parameters
+        ----------
+        start, stop : int | None
+            Range of LEDs written. By default, the whole strip.
+        """
+        self._update(start, stop)
+
+
+    def _encode(self):
+        timer = self._timer
+        if timer is not None:
+            t0 = time.perf_counter()
+        # nearby ranges are encoded together to save per-call overhead
+        for start, stop in _merge_ranges(self._dirty, gap=16):
+            colors = self._colors[start:stop]
+            if self._pre_buffer is not None:
+                colors = np.minimum(1, colors,
+                                    out=self._pre_buffer[start:stop])
+            self._make_pixel(colors, self._pixels[start:stop])
+        self._dirty = []
+        self._stale = False
+        if timer is not None:
+            timer.encode += time.perf_counter() - t0
+
+
+    @contextmanager
+    def _offscreen(self):
+        """Composite into a blank scratch buffer, leaving the strip alone"""
+        state = (self._colors, self._deferred, self._stale, self._dirty,
+                 self._lit)
+        self._colors = np.zeros_like(self._colors)
+        self._deferred = True
+        self._dirty = []
+        self._lit = []
+        try:
+            yield self._colors
+        finally:
+            (self._colors, self._deferred, self._stale, self._dirty,
+             self._lit) = state
+
+
+    def _render(self, frame, out, blend_mode='add'):
+        """Encode colors or shapes as a full frame into out
+
+        Must be called within ``_offscreen``.
+        """
+        self._colors.fill(0)
+        if isinstance(frame, np.ndarray):
+            self._colors[:] = to_dtype(frame, self._colors.dtype)
+        else:
+            for shape in (frame if isinstance(frame, (list, tuple))
+                          else [frame]):
+                shape.draw(blend_mode)
+        if self._pre_buffer is not None:
+            np.minimum(1, self._colors, out=self._colors)
+        self._make_pixel(self._colors,
+                         out[4:4 + 4 * self._n_leds].reshape(-1, 4))
 
-    def _gamma_correct(self, x):
-        
-        ref_vals = np.array([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                             0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                             0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-                             1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 3, 3, 3,
-                             3, 3, 3, 3, 4, 4, 4, 4, 4, 5, 5, 5, 5,
-                             6, 6, 6, 6, 7, 7, 7, 7, 8, 8, 8, 9, 9,
-                             9, 10, 10, 10, 11, 11, 11, 12, 12, 13, 13, 13, 
-                             14, 14, 15, 15, 16, 16, 17, 17, 18, 18, 19, 19, 
-                             20, 20, 21, 21, 22, 22, 23, 24, 24, 25, 25, 26,
-                             27, 27, 28, 29, 29, 30, 31, 32, 32, 33, 34, 35, 
-                             35, 36, 37, 38, 39, 39, 40, 41, 42, 43, 44, 45, 
-                             46, 47, 48, 49, 50, 50, 51, 52, 54, 55, 56, 57, 
-                             58, 59, 60, 61, 62, 63, 64, 66, 67, 68, 69, 70, 
-                             72, 73, 74, 75, 77, 78, 79, 81, 82, 83, 85, 86, 
-                             87, 89, 90, 92, 93, 95, 96, 98, 99, 101, 102, 104, 
-                             105, 107, 109, 110, 112, 114, 115, 117, 119, 120, 
-                             122, 124, 126, 127, 129, 131, 133, 135, 137, 138, 
-                             140, 142, 144, 146, 148, 150, 152, 154, 156, 158, 
-                             160, 162, 164, 167, 169, 171, 173, 175, 177, 180, 
-                             182, 184, 186, 189, 191, 193, 196, 198, 200, 203,
-                             205, 208, 210, 213, 215, 218, 220, 223, 225, 228,
-                             231, 233, 236, 239, 241, 244, 247, 249, 252, 255])
-#        coefs = np.array([ 0.7862484 ,  0.24822052, -0.03472465,  0.00123544])
-#        return np.maximum(np.minimum(np.polyval(coefs, x) - .003, 1), 0)
-        return ref_vals[np.array(np.ceil(x * 255), dtype=int)]
+
+    @property
+    def buffer(self):
+        """The encoded frame that will be sent"""
+        if self._shared is not None:
+            self._read_shared()
+        if self._stale:
+            self._encode()
+        return self._buffer
 
 
     def clear_strip(self):
         """Zero the LED buffer"""
-        self._colors = np.zeros((self._n_leds, 4))
-        self._buffer = self._make_bytes(self._colors)
+        self._colors.fill(0)
+        # only LEDs lit since the last clear need re-encoding
+        lit, self._lit = self._lit, []
+        for start, stop in _merge_ranges(lit):
+            self._update(start, stop)
+        self._lit = []
 
 
     def send(self):
         """Execute LED OSC command"""
-        self._client.sendall(bytes(self._buffer))
-            
-        
-    def convert_units(self, pos, fro, to):
-        """Convert units of LED index to degrees azimuth
-        
+        if self._shared is not None:
+            self._read_shared()
+        if self._stale:
+            self._encode()
+        self._transmit(self._view)
+
+
+    def share_colors(self, timeout=1.):
+        """Move the colors into shared memory for another process to write
+
+        The other process opens them with ``SharedColors(name)`` and writes
+        pixels in place. ``send`` then encodes the latest complete write
+        straight from shared memory. Shapes can still be drawn here too.
+        Strips in a StripGroup draw into the group's colors, so they cannot
+        share them.
+
         Parameters
         ----------
-        pos : int or list or 1D array
-            positions in either int or deg
-        fro : str
-            the units of pos -- either 'int' or 'deg'
-        to : str
-            the desired units -- either 'int' or 'deg'
+        timeout : float
+            Seconds ``send`` waits for a write under way to finish. If the
+            writer died mid-write, it then raises RuntimeError rather than
+            waiting forever; call ``unshare_colors`` to carry on.
+
+        Returns
+        -------
+        name : str
+            Name of the shared memory block.
         """
+        if self._shared is not None:
+            return self._shared.name
+        colors = self._colors
+        if not colors.flags.owndata:
+            raise RuntimeError('The colors of a strip in a StripGroup '
+                               'cannot be shared')
+        self._shared_timeout = timeout
+        self._shared = shared_memory.SharedMemory(
+            create=True, size=_SHARED_OFFSET + colors.nbytes)
+        header = np.ndarray(1, dtype=_SHARED_HEADER, buffer=self._shared.buf)
+        header[0] = (0, self._n_leds, colors.dtype.str.encode())
+        self._shared_seq = 0
+        self._colors = np.ndarray(colors.shape, dtype=colors.dtype,
+                                  buffer=self._shared.buf,
+                                  offset=_SHARED_OFFSET)
+        self._colors[:] = colors
+        return self._shared.name
 
-        calibration_inds = [246, 493, 740, 1008]
-        calibration_deg = [58, 10, -38, -90]
-        if isinstance(pos, int):
-            pos = [pos]
-        if fro == 'ind' and to == 'deg':        
-            if self._offset:
-                fit = np.polyfit(calibration_inds, np.array(calibration_deg) + 2, 1)
-            else:
-                fit = np.polyfit(calibration_inds, calibration_deg, 1)
-        elif fro == 'deg' and to == 'ind':
-            if self._offset:
-                fit = np.polyfit(np.array(calibration_deg) + 2, calibration_inds, 1)
-            else:
-                fit = np.polyfit(calibration_deg, calibration_inds, 1)
+
+    def unshare_colors(self):
+        """Copy the colors back into private memory and free the shared block
+        """
+        if self._shared is not None:
+            shared, self._shared = self._shared, None
+            self._colors = self._colors.copy()
+            shared.close()
+            if os.name == 'posix':
+                # writers started with multiprocessing share our resource
+                # tracker, and SharedColors takes the block off it
+                resource_tracker.register(shared._name, 'shared_memory')
+            shared.unlink()
+
+
+    def _read_shared(self):
+        """Encode the last complete write to the shared colors, if new"""
+        seq = np.ndarray(1, dtype=_SHARED_HEADER,
+                         buffer=self._shared.buf)['seq']
+        waiting_on = None
+        while True:
+            start = int(seq[0])
+            if start == self._shared_seq:
+                return
+            if start & 1:
+                # a write is under way, unless its writer died during it
+                if start != waiting_on:
+                    waiting_on = start
+                    deadline = time.monotonic() + self._shared_timeout
+                elif time.monotonic() > deadline:
+                    raise RuntimeError('A write to the shared colors has not '
+                                       'finished in %s s, its writer may have '
+                                       'died' % self._shared_timeout)
+                time.sleep(0)
+                continue
+            self._dirty.append((0, self._n_leds))
+            self._lit = [(0, self._n_leds)]
+            self._encode()
+            # a write that overlapped the encode may have torn it, so redo it
+            if int(seq[0]) == start:
+                self._shared_seq = start
+                return
+
+
+    def _transmit(self, frame):
+        timer = self._timer
+        if timer is not None:
+            t0 = time.perf_counter()
+        if self._sender is None:
+            self._write(frame)
         else:
-            raise ValueError('fro and to must be "ind" and "deg", "deg"'
-                             'and "ind" or "deg"')
-        return [np.polyval(fit, p) for p in pos]
-    
-    def get_nearest_speaker(self, azimuth, units):    
-        if units == 'ind':
-            azimuth = self.convert_units(azimuth, 'ind', 'deg')
-        if units == 'deg' and self._offset:
-            azimuth -= 2
-        return int(azimuth / 4 + 26)
-    
-    def get_speaker_location(self, speaker_ind, to_units):
-        azimuth = (speaker_ind - 26) * 4
-        if to_units == 'ind':
-            azimuth = self.convert_units(azimuth, 'deg', 'ind')
-        return azimuth
+            self._sender.publish(frame)
+        if timer is not None:
+            timer.add_frame(t0, time.perf_counter() - t0, len(frame))
+
+
+    def _write(self, frame):
+        recorder = self._recorder
+        if recorder is not None:
+            t_send = time.monotonic()
+        message = frame
+        if self._framed:
+            message = self._pack_message(frame)
+        if self._tcp:
+            self._client.sendall(message)
+        else:
+            for header, payload in iter_segments(message, self._n_frames,
+                                                 self._packet_size):
+                self._client.sendmsg([header, payload])
+        self._n_frames += 1
+        if recorder is not None:
+            recorder.add(t_send, frame)
+
+
+    def _pack_message(self, frame):
+        """Pack a frame as a keyframe or delta against the last frame sent"""
+        frame = np.frombuffer(frame, dtype=np.uint8)
+        if self._keyframe_interval is None:
+            return pack_keyframe(frame, self._n_frames, self._compression)
+        last = self._last_sent
+        message = None
+        if (last is not None and len(last) == len(frame) and
+                self._n_frames - self._last_key < self._keyframe_interval):
+            message = pack_delta(frame, last, self._n_frames)
+            if len(message) >= MESSAGE_HEADER.size + len(frame):
+                message = None
+        if message is None:
+            message = pack_keyframe(frame, self._n_frames, self._compression)
+            self._last_key = self._n_frames
+        if last is None or len(last) != len(frame):
+            self._last_sent = frame.copy()
+        else:
+            last[:] = frame
+        return message
+
+
+    def start_sender(self, rate=None):
+        """Send frames from a background thread
+
+        ``send`` and ``send_frame`` then copy the frame into a back buffer
+        and return immediately. If a newer frame is published before the
+        pending one goes out, the pending one is dropped.
+
+        Parameters
+        ----------
+        rate : float | None
+            Maximum frames per second to transmit. If None, frames are sent
+            as fast as the link drains them.
+        """
+        if self._sender is not None:
+            raise RuntimeError('Sender is already running')
+        self._sender = _Sender(self._write, len(self._buffer), rate)
+        self._sender.start()
+
+
+    def stop_sender(self):
+        """Send any pending frame and stop the background sender thread"""
+        if self._sender is not None:
+            sender, self._sender = self._sender, None
+            try:
+                sender.stop()
+            finally:
+                self._n_sent += sender.n_sent
+                self._n_dropped += sender.n_dropped
+
+
+    def start_recording(self, fname, capacity=6000):
+        """Record every frame sent, with its time, to a file
+
+        Frames are recorded as they are written to the client, after the
+        write, so a background sender also records off the calling thread.
+        Read the file back with FrameLog.
+
+        Parameters
+        ----------
+        fname : str
+            File to record to. It is overwritten.
+        capacity : int
+            Number of frames the file first has room for, prepared up front.
+            Once it is three quarters full, a helper thread doubles it and
+            prepares the new room, so sends do not wait on the file growing.
+        """
+        if self._recorder is not None:
+            raise RuntimeError('Already recording')
+        self._recorder = _FrameRecorder(fname, self._n_leds,
+                                        len(self._buffer), capacity)
+
+
+    def stop_recording(self):
+        """Stop recording frames and close the file"""
+        if self._recorder is not None:
+            recorder, self._recorder = self._recorder, None
+            recorder.close()
+
+
+    def start_timing(self, size=1000, callback=None):
+        """Record how long each frame spends compositing, encoding and sending
+
+        Parameters
+        ----------
+        size : int
+            Number of most recent frames kept.
+        callback : callable | None
+            Called after every sent frame with a dict of its timings.
+        """
+        self._timer = _FrameTimer(size, callback)
+
+
+    def stop_timing(self):
+        """Stop recording frame timings"""
+        self._timer = None
+
+
+    def timing_stats(self):
+        """Summarize recorded frame timings
+
+        Returns
+        -------
+        stats : dict
+            For each of 'composite', 'encode' and 'send', the mean, p50, p99
+            and max stage time in seconds. 'interval' gives the mean, std
+            (jitter) and max time between sends, and 'bytes_per_sec' the
+            throughput over the recorded frames.
+        """
+        if self._timer is None:
+            raise RuntimeError('Timing is not enabled, use start_timing')
+        return self._timer.stats()
+
+
+    @property
+    def n_sent(self):
+        """Number of frames transmitted by the background sender"""
+        live = 0 if self._sender is None else self._sender.n_sent
+        return self._n_sent + live
+
+
+    @property
+    def n_dropped(self):
+        """Number of frames replaced by newer ones before they were sent"""
+        live = 0 if self._sender is None else self._sender.n_dropped
+        return self._n_dropped + live
+
+
+    def send_frame(self, frames, idx):
+        """Send one pre-encoded frame, leaving the LED buffer untouched
+
+        Parameters
+        ----------
+        frames : instance of FrameSequence
+            Frames encoded for this strip.
+        idx : int
+            Index of the frame to send.
+        """
+        frame = frames[idx]
+        if len(frame) != len(self._buffer):
+            raise ValueError('frames were encoded for a different strip')
+        self._transmit(frame)
+
+
+class StripGroup(_Positioned):
+    """Several DotStrips drawn as one strip and sent together
+
+    Shapes made with the group as their ``led`` are positioned along the
+    strips laid end to end, in the order given.
+
+    Parameters
+    ----------
+    strips : list of DotStrip
+        The strips, each with its own client. Their colors must not be
+        shared with ``share_colors``.
+    offset : bool
+        If True, shift the calibration by 2 degrees.
+    calibration : str | array, shape (n_points, 2) | None
+        Calibration points over the joined strips, as for DotStrip.
+    calibration_kind : str
+        'linear' or 'piecewise' mapping through the calibration points.
+    history : int
+        Number of recent frames whose send skew is kept in ``skews``.
+    Returns
+    -------
+    group : instance of StripGroup
+        The strip group object.
+    """
+
+    def __init__(self, strips, offset=False, calibration=None,
+                 calibration_kind='linear', history=1000):
+        self._strips = list(strips)
+        if not self._strips:
+            raise ValueError('StripGroup needs at least one strip')
+        for strip in self._strips:
+            _check_blocking(strip, 'StripGroup')
+            if strip._shared is not None:
+                raise ValueError('Strips whose colors are shared cannot join '
+                                 'a StripGroup')
+        bounds = np.cumsum([0] + [strip._n_leds for strip in self._strips])
+        self._bounds = bounds.tolist()
+        self._n_leds = self._bounds[-1]
+        dtypes = set(strip._colors.dtype for strip in self._strips)
+        if len(dtypes) > 1:
+            raise ValueError('All strips must use the same dtype')
+        # the strips draw from views into one buffer for the whole group
+        self._colors = np.zeros((self._n_leds, 4), dtype=dtypes.pop())
+        for strip, lo, hi in zip(self._strips, bounds[:-1], bounds[1:]):
+            self._colors[lo:hi] = strip._colors
+            strip._colors = self._colors[lo:hi]
+            strip._update()
+        self._set_calibration(calibration, calibration_kind, offset)
+        self._timer = None
+        self._pool = ThreadPoolExecutor(len(self._strips))
+        self.skews = deque(maxlen=history)
+
+
+    def _update(self, start=0, stop=None):
+        if stop is None:
+            stop = self._n_leds
+        for strip, lo, hi in zip(self._strips, self._bounds[:-1],
+                                 self._bounds[1:]):
+            if start < hi and stop > lo:
+                strip._update(max(start, lo) - lo, min(stop, hi) - lo)
+
+
+    def mark_dirty(self, start=0, stop=None):
+        """Flag LEDs whose colors were written directly into the buffer"""
+        self._update(start, stop)
+
+
+    def clear_strip(self):
+        """Zero the LED buffers of all strips"""
+        for strip in self._strips:
+            strip.clear_strip()
+
+
+    def send(self):
+        """Send the current frame to every strip in parallel
+
+        Returns
+        -------
+        skew : float
+            Seconds between the first and last strip finishing its send.
+        """
+        # encode everything first so that the sends start together
+        for strip in self._strips:
+            strip.buffer
+        done = list(self._pool.map(self._send_strip, self._strips))
+        skew = max(done) - min(done)
+        self.skews.append(skew)
+        return skew
+
+
+    @staticmethod
+    def _send_strip(strip):
+        strip.send()
+        return time.perf_counter()
+
+
+    def close(self):
+        """Stop the threads used for sending"""
+        self._pool.shutdown()
+
+
+class _Calibration(object):
+    """Maps between LED index and degrees azimuth, fit once
+
+    Parameters
+    ----------
+    inds : array
+        LED indices of the calibration points.
+    degs : array
+        Azimuths of the calibration points in degrees.
+    kind : str
+        'linear' fits a line in each direction, 'piecewise' interpolates
+        linearly between points and extends the end segments.
+    """
+
+    def __init__(self, inds, degs, kind='linear'):
+        inds = np.asarray(inds, dtype=np.float64)
+        degs = np.asarray(degs, dtype=np.float64)
+        if inds.shape != degs.shape or inds.ndim != 1 or len(inds) < 2:
+            raise ValueError('Calibration needs at least 2 pairs of points')
+        if kind == 'linear':
+            self._to_deg = np.polyfit(inds, degs, 1)
+            self._to_ind = np.polyfit(degs, inds, 1)
+        elif kind == 'piecewise':
+            order = np.argsort(inds)
+            inds, degs = inds[order], degs[order]
+            if np.any(np.diff(inds) <= 0) or not (
+                    np.all(np.diff(degs) > 0) or np.all(np.diff(degs) < 0)):
+                raise ValueError('Piecewise calibration must be monotonic')
+            self._to_deg = (inds, degs)
+            order = np.argsort(degs)
+            self._to_ind = (degs[order], inds[order])
+        else:
+            raise ValueError('kind must be "linear" or "piecewise"')
+        self._kind = kind
+
+
+    def _apply(self, fit, x):
+        if self._kind == 'linear':
+            return np.polyval(fit, x)
+        xp, fp = fit
+        y = np.interp(x, xp, fp)
+        lo = x < xp[0]
+        hi = x > xp[-1]
+        y[lo] = fp[0] + (x[lo] - xp[0]) * (fp[1] - fp[0]) / (xp[1] - xp[0])
+        y[hi] = fp[-1] + ((x[hi] - xp[-1]) * (fp[-1] - fp[-2]) /
+                          (xp[-1] - xp[-2]))
+        return y
+
+
+    def to_deg(self, inds):
+        return self._apply(self._to_deg, inds)
+
+
+    def to_ind(self, degs):
+        return self._apply(self._to_ind, degs)
+
+
+class _FrameTimer(object):
+    """Fixed-size ring buffer of per-frame stage timings"""
+
+    fields = ('time', 'composite', 'encode', 'send', 'bytes')
+
+    def __init__(self, size, callback=None):
+        self._log = np.zeros((size, len(self.fields)))
+        self._n = 0
+        self._callback = callback
+        self.composite = 0.
+        self.encode = 0.
+
+
+    def add_frame(self, t_send, send, n_bytes):
+        row = self._log[self._n % len(self._log)]
+        row[:] = (t_send, self.composite, self.encode, send, n_bytes)
+        self._n += 1
+        self.composite = self.encode = 0.
+        if self._callback is not None:
+            self._callback(dict(zip(self.fields, row.tolist())))
+
+
+    def stats(self):
+        n = min(self._n, len(self._log))
+        log = np.roll(self._log, -(self._n % len(self._log)), 0)[-n:]
+        stats = dict(n_frames=self._n)
+        for name in ('composite', 'encode', 'send'):
+            x = log[:, self.fields.index(name)]
+            stats[name] = dict(mean=x.mean(), p50=np.percentile(x, 50),
+                               p99=np.percentile(x, 99), max=x.max()) \
+                if n else dict()
+        times = log[:, 0]
+        intervals = np.diff(times)
+        stats['interval'] = dict(mean=intervals.mean(), std=intervals.std(),
+                                 max=intervals.max()) if n > 1 else dict()
+        stats['bytes_per_sec'] = (log[1:, -1].sum() / (times[-1] - times[0])
+                                  if n > 1 and times[-1] > times[0] else 0.)
+        return stats
+
+
+# Shared colors start with a sequence number, odd while a write is under
+# way, then the size and dtype of the colors that follow at _SHARED_OFFSET
+_SHARED_HEADER = np.dtype([('seq', '<u8'), ('n_leds', '<u8'),
+                           ('dtype', 'S8')])
+_SHARED_OFFSET = 64
+
+
+class SharedColors(object):
+    """Writer end of colors shared with DotStrip.share_colors
+
+    Parameters
+    ----------
+    name : str
+        Name returned by ``DotStrip.share_colors``.
+
+    Attributes
+    ----------
+    colors : array, shape (n_leds, 4)
+        RGBA colors in shared memory, of the strip's dtype. Write them
+        within ``write``.
+    """
+
+    def __init__(self, name):
+        if 'track' in shared_memory.SharedMemory.__init__.__code__.co_varnames:
+            self._shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            if os.name == 'posix':
+                # only the strip's process may unlink the block
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+        header = np.ndarray(1, dtype=_SHARED_HEADER, buffer=self._shm.buf)
+        self._seq = header['seq']
+        self.colors = np.ndarray((int(header['n_leds'][0]), 4),
+                                 dtype=header['dtype'][0].decode(),
+                                 buffer=self._shm.buf, offset=_SHARED_OFFSET)
+
+
+    @contextmanager
+    def write(self):
+        """Write a frame of colors in place
+
+        The strip never sends a partly written frame. Use as::
+
+            with shared.write() as colors:
+                colors[:] = new_colors
+        """
+        self._seq[0] += 1
+        try:
+            yield self.colors
+        finally:
+            self._seq[0] += 1
+
+
+    @property
+    def n_writes(self):
+        """Number of completed writes"""
+        return int(self._seq[0]) // 2
+
+
+    def close(self):
+        """Detach from the shared colors"""
+        self._seq = self.colors = None
+        self._shm.close()
+
+
+# Frame logs hold a header, then one fixed-size record per frame of its
+# time.monotonic send time and encoded bytes, so frame i is at a known offset
+_LOG_MAGIC = b'LEDLOG01'
+_LOG_HEADER = np.dtype([('magic', 'S8'), ('n_leds', '<u4'),
+                        ('frame_bytes', '<u4'), ('n_frames', '<u8')])
+
+
+def _log_record(frame_bytes):
+    return np.dtype([('time', '<f8'), ('frame', np.uint8, (frame_bytes,))])
+
+
+class _FrameRecorder(object):
+    """Appends frames to a frame log, growing the file as needed
+
+    Once the log is three quarters full, a helper thread maps the file at
+    twice the size and touches the new records, so ``add`` only ever copies
+    into pages that are already mapped.
+    """
+
+    _touch_bytes = 1 << 18
+
+    def __init__(self, fname, n_leds, frame_bytes, capacity):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self._fname = fname
+        self._record = _log_record(frame_bytes)
+        self._header = np.memmap(fname, dtype=_LOG_HEADER, mode='w+',
+                                 shape=(1,))
+        self._header[0] = (_LOG_MAGIC, n_leds, frame_bytes, 0)
+        self._n_frames = self._header.view(np.ndarray)['n_frames']
+        self._n = 0
+        self._lock = threading.Lock()
+        self._use(self._map(capacity))
+        # touch the pages now rather than faulting them in during sends
+        self._times.fill(0)
+        self._frames.fill(0)
+        # the next, larger mapping and the ones it replaced, which are
+        # dropped on the helper thread so sends never wait on munmap
+        self._grow_wanted = threading.Event()
+        self._grown = threading.Event()
+        self._growing = False
+        self._closing = False
+        self._next = None
+        self._grow_error = None
+        self._retired = []
+        self._grower = threading.Thread(target=self._run_grower,
+                                        name='frame log grower', daemon=True)
+        self._grower.start()
+
+
+    def _map(self, capacity):
+        # np.memmap extends the file when it is too short
+        return np.memmap(self._fname, dtype=self._record, mode='r+',
+                         offset=_LOG_HEADER.itemsize, shape=(capacity,))
+
+
+    def _use(self, records):
+        self._records = records
+        # plain array views skip the overhead of indexing a memmap
+        records = records.view(np.ndarray)
+        self._times = records['time']
+        self._frames = records['frame']
+
+
+    def _run_grower(self):
+        if sys.platform.startswith('linux'):
+            # lowest priority, so it yields the CPU to sends on small
+            # machines; Linux applies this to the one thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        while True:
+            self._grow_wanted.wait()
+            self._grow_wanted.clear()
+            if self._closing:
+                return
+            del self._retired[:]
+            capacity = len(self._records)
+            try:
+                records = self._map(2 * capacity)
+                # earlier records are still written through the old mapping.
+                # Touch the new ones a little at a time, so sends can take
+                # the GIL in between
+                new = records[capacity:].view(np.ndarray).view(np.uint8)
+                for start in range(0, len(new), self._touch_bytes):
+                    new[start:start + self._touch_bytes] = 0
+                    time.sleep(0)
+                self._next = records
+            except Exception as exc:
+                self._grow_error = exc
+            self._grown.set()
+
+
+    def add(self, t_send, frame):
+        with self._lock:
+            if self._closing:
+                return
+            if self._n == len(self._records):
+                # only waits if sends outpace the helper thread
+                self._grown.wait()
+                self._grown.clear()
+                if self._grow_error is not None:
+                    # try again, and fail this frame
+                    error, self._grow_error = self._grow_error, None
+                    self._grow_wanted.set()
+                    raise error
+                self._growing = False
+                self._retired.extend([self._records, self._times,
+                                      self._frames])
+                self._use(self._next)
+                self._next = None
+            self._times[self._n] = t_send
+            self._frames[self._n] = frame
+            self._n += 1
+            self._n_frames[0] = self._n
+            if not self._growing and 4 * self._n >= 3 * len(self._records):
+                self._growing = True
+                self._grow_wanted.set()
+
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+        self._grow_wanted.set()
+        self._grower.join()
+        with self._lock:
+            self._records.flush()
+            self._header.flush()
+            self._records = self._times = self._frames = None
+            self._header = self._n_frames = None
+            self._next = None
+            self._retired = []
+        # drop the unused room at the end
+        os.truncate(self._fname,
+                    _LOG_HEADER.itemsize + self._n * self._record.itemsize)
+
+
+class _Sender(threading.Thread):
+    """Double-buffered worker thread that writes the latest frame"""
+
+    def __init__(self, write, n_bytes, rate=None):
+        threading.Thread.__init__(self, name='DotStrip sender', daemon=True)
+        self._write = write
+        self._buffers = [np.zeros(n_bytes, dtype=np.uint8) for _ in range(2)]
+        self._back = 0
+        self._pending = False
+        self._running = True
+        self._error = None
+        self._period = 0. if rate is None else 1. / rate
+        self._cond = threading.Condition()
+        self.n_sent = 0
+        self.n_dropped = 0
+
+
+    def publish(self, frame):
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if self._pending:
+                self.n_dropped += 1
+            self._buffers[self._back][:] = frame
+            self._pending = True
+            self._cond.notify()
+
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self.join()
+        if self._error is not None:
+            raise self._error
+
+
+    def run(self):
+        deadline = time.monotonic()
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                front = self._back
+                self._back = 1 - front
+                self._pending = False
+            try:
+                self._write(self._buffers[front])
+            except Exception as exc:
+                with self._cond:
+                    self._error = exc
+                return
+            self.n_sent += 1
+            if self._period:
+                now = time.monotonic()
+                deadline = max(deadline + self._period, now)
+                time.sleep(deadline - now)
+
+
+# envelopes are cached by shape parameters, so shifted copies of a shape
+# only pay for coloring their slab
+_ENVELOPE_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=_ENVELOPE_CACHE_SIZE)
+def _gaussian_envelope(width, threshold, frac):
+    """Gaussian envelope cut at threshold, centered frac past an LED
+
+    Returns the first lit LED relative to that LED and the read-only
+    envelope values from there.
+    """
+    half = width * np.sqrt(-2 * np.log(min(threshold, 1)))
+    x = np.arange(int(np.floor(frac - half)) - 1,
+                  int(np.ceil(frac + half)) + 2)
+    env = np.exp(-np.power(x - frac, 2.) / (2 * np.power(width, 2.)))
+    lit = np.flatnonzero(env >= threshold)
+    if len(lit):
+        offset = int(x[lit[0]])
+        env = env[lit[0]:lit[-1] + 1]
+    else:
+        offset = 0
+        env = env[:0]
+    env.flags.writeable = False
+    return offset, env
+
+
+@lru_cache(maxsize=_ENVELOPE_CACHE_SIZE)
+def _tukey_window(width, alpha):
+    """Read-only Tukey window"""
+    from scipy.signal.windows import tukey
+    win = tukey(width, alpha)
+    win.flags.writeable = False
+    return win
+
+
+def _resample(colors, n_out, axis):
+    """Cubic-spline resample colors to n_out samples along axis
+
+    The result never shares memory with colors, so shapes made from it do
+    not change when the caller reuses its array.
+    """
+    n_in = colors.shape[axis]
+    if n_in == n_out:
+        return colors.copy()
+    if n_in < 2:
+        return np.repeat(colors, n_out, axis)
+    from scipy.interpolate import CubicSpline
+    # fit every channel of every frame as columns of one 2D spline
+    colors = np.moveaxis(colors, axis, 0)
+    shape = colors.shape[1:]
+    cs = CubicSpline(np.arange(n_in), colors.reshape(n_in, -1))
+    colors = cs(np.linspace(0, n_in - 1, n_out)).reshape((n_out,) + shape)
+    return np.ascontiguousarray(np.moveaxis(colors, 0, axis))
+
 
 class _LightShape(object):
     """Super class for led objects"""
@@ -184,7 +1293,19 @@ class _LightShape(object):
         if len(color) != 4:
             raise ValueError('Must specify RGBA color')
         self._fill_color = color
-        self._colors = np.zeros(self._led._colors.shape)
+        # colors are only stored for the lit extent, starting at _start
+        self._start = 0
+        self._colors = np.zeros((0, 4), dtype=self._led._colors.dtype)
+
+
+    def _set_colors(self, start, colors):
+        """Store the colors of LEDs from start onward, cropped to the strip"""
+        stop = start + len(colors)
+        lo = min(max(start, 0), self._led._n_leds)
+        hi = max(min(stop, self._led._n_leds), lo)
+        self._start = lo
+        colors = colors[lo - start:hi - start]
+        self._colors = to_dtype(colors, self._led._colors.dtype)
 
 
     def draw(self, blend_mode='add'):
@@ -197,25 +1318,19 @@ class _LightShape(object):
             'add' : add translucent object on top of existing objects
             'max' : show whichever object is brighter
             'occlude' : add opaque object on top of existing objects
+            'over' : alpha-composite object over existing objects
+            'multiply' : multiply existing objects by the object
+            'screen' : brighten existing objects by the object
         """
 
-        if blend_mode == 'add':
-            self._led._colors += self._colors
-            if any(self._led._colors.ravel() > 1):
-                logger.warning('Buffer values exceed 1. '
-                               'Color distortion may occur.')
-        if blend_mode == 'max':
-            inds = np.where([dat > col for dat, col
-                             in zip(self._colors[:, -1],
-                                    self._led._colors[:, -1])])
-            self._led._colors[inds] = self._colors[inds]
-        if blend_mode == 'occlude':
-            self._led._colors[self._colors[:, -1] > 0] = \
-                self._colors[self._colors[:, -1] > 0]
-        
-        self._led._buffer = \
-            self._led._make_bytes(np.minimum(1, self._led._colors))
-        self._led._pre_buffer = np.zeros((self._led._pre_buffer.shape))
+        timer = self._led._timer
+        if timer is not None:
+            t0 = time.perf_counter()
+        blend(self._led._colors[self._start:self._start + len(self._colors)],
+              self._colors, blend_mode)
+        if timer is not None:
+            timer.composite += time.perf_counter() - t0
+        self._led._update(self._start, self._start + len(self._colors))
 
 
 class Dot(_LightShape):
@@ -248,7 +1363,9 @@ class Dot(_LightShape):
             pos = int(np.round(self._led.convert_units(pos, 'deg', 'ind')[0]))
         else:
             raise ValueError('units must be either "ind" or "deg"')
-        self._colors[pos] = color
+        if not 0 <= pos < self._led._n_leds:
+            raise ValueError('pos must be within the strip')
+        self._set_colors(pos, [color])
 
 
 class Line(_LightShape):
@@ -280,7 +1397,7 @@ class Line(_LightShape):
             pos = np.array(np.round(self._led.convert_units(pos, 'deg', 'ind')),
                            dtype=int)
             pos = np.flip(pos, 0)
-        self._colors[pos[0]:pos[1]] = color
+        self._set_colors(pos[0], np.tile(color, (max(pos[1] - pos[0], 0), 1)))
 
 
 class Gaussian(_LightShape):
@@ -316,13 +1433,18 @@ class Gaussian(_LightShape):
             pos = self._led.convert_units(pos, 'deg', 'ind')[0]
             width = np.abs(self._led.convert_units(width, 'deg', 'ind')[0] - 
                            self._led._n_leds // 2)
-        colors = np.ones(self._led._colors.shape) * color
-        x = np.arange(self._led._n_leds)
-        env = np.exp(-np.power(x - pos, 2.) / (2 * np.power(width, 2.)))
-        env[env < threshold] = 0
+        if threshold > 0:
+            center = int(np.floor(pos))
+            offset, env = _gaussian_envelope(float(width), float(threshold),
+                                             float(pos - center))
+            start = center + offset
+        else:
+            start = 0
+            x = np.arange(self._led._n_leds)
+            env = np.exp(-np.power(x - pos, 2.) / (2 * np.power(width, 2.)))
+        colors = np.ones((len(env), 4)) * color
         colors[:, -1] *= env
-        colors[env < threshold] = 0
-        self._colors = colors
+        self._set_colors(start, colors)
 
 
 class Tukey(_LightShape):
@@ -352,20 +1474,18 @@ class Tukey(_LightShape):
 
     def __init__(self, ec, led, color, pos, width, alpha, units='ind'):
         _LightShape.__init__(self, ec, led, color)
-        from scipy.signal import tukey
         if units == 'deg':
             pos = self._led.convert_units([pos], 'deg', 'ind')[0]
             width = np.abs(self._led.convert_units(width, 'deg', 'ind')[0] - 
                            self._led._n_leds // 2)
         colors = np.ones((int(width), 4)) * color
-        win = tukey(int(width), alpha)
+        win = _tukey_window(int(width), float(alpha))
         start = int(pos - width/2)
-        stop = int(start + width)
         colors[:, -1] *= win
-        self._colors[start:stop] = colors
+        self._set_colors(start, colors)
 
 
-class PixelArray():
+class PixelArray(_LightShape):
     """Set arbitray pixel colors
     
     Parameters
@@ -375,13 +1495,9 @@ class PixelArray():
     led : instance of DotStrip
         Parent LED.
     colors : N x 4 array
-        Fill colors of the dots
+        Fill colors of the dots, resampled to fit extent if needed
     extent : 2x1 array or list of 2
         elements must be int if 'ind', else can be int or float
-    width : int
-        width of the tukey window
-    alpha : float
-        tukey parameter
     units : str
         'ind', 'deg'
     Returns
@@ -391,47 +1507,442 @@ class PixelArray():
     """
 
     def __init__(self, ec, led, colors, extent, units='ind'):
-        from scipy.interpolate import CubicSpline
         self._ec = ec
         self._led = led
-        if colors.shape[-1] != 4:
+        colors = np.asarray(colors, dtype=np.float64)
+        if colors.ndim != 2 or colors.shape[-1] != 4:
             raise ValueError('Must specify RGBA colors')
+        start, stop = self._get_extent(led, extent, units)
+        self._set_colors(start, _resample(colors, stop - start, 0))
+
+
+    @staticmethod
+    def _get_extent(led, extent, units):
         if units == 'deg':
-            extent = self._led.convert_units(extent, 'deg', 'ind')
-        if np.diff(extent) != colors.shape[0]:
-            cs = CubicSpline(np.arange(len(colors)), colors)
-            colors = cs(np.arange(self._led._n_leds) / len(colors))
-        self._colors = np.zeros(self._led._colors.shape)
-        self._colors[extent[0]:extent[1]] = colors
+            extent = np.flip(np.round(led.convert_units(extent, 'deg', 'ind')),
+                             0)
+        elif units != 'ind':
+            raise ValueError('units must be either "ind" or "deg"')
+        start, stop = [int(e) for e in extent]
+        if stop <= start:
+            raise ValueError('extent must be specified as [start, stop]')
+        return start, stop
 
 
-    def draw(self, blend_mode='add'):
-        """Draw LightShape object onto led buffer
-        
+    @classmethod
+    def from_frames(cls, ec, led, frames, extent, units='ind'):
+        """Make one PixelArray per frame of a stack of colors
+
+        All frames are resampled into the extent in a single interpolation.
+
         Parameters
         ----------
+        ec : instance of ExperimentController
+            Parent EC.
+        led : instance of DotStrip
+            Parent LED.
+        frames : n_frames x N x 4 array
+            Fill colors of the dots in each frame
+        extent : 2x1 array or list of 2
+            elements must be int if 'ind', else can be int or float
+        units : str
+            'ind', 'deg'
+        Returns
+        -------
+        pixelarrays : list of PixelArray
+            One pixelarray object per frame, ready to draw or to pass to
+            FrameSequence.
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        if frames.ndim != 3 or frames.shape[-1] != 4:
+            raise ValueError('Must specify n_frames x N x 4 RGBA colors')
+        start, stop = cls._get_extent(led, extent, units)
+        frames = _resample(frames, stop - start, 1)
+        pixelarrays = []
+        for colors in frames:
+            pixelarray = cls.__new__(cls)
+            pixelarray._ec = ec
+            pixelarray._led = led
+            pixelarray._set_colors(start, colors)
+            pixelarrays.append(pixelarray)
+        return pixelarrays
+
+
+def _render_chunk(led, make_frame, blend_mode, shape, shm_name, fname, lo,
+                  hi):
+    """Make and encode frames lo to hi into frames shared with the parent"""
+    if fname is None:
+        shm = shared_memory.SharedMemory(shm_name)
+        frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    else:
+        shm = None
+        frames = np.memmap(fname, dtype=np.uint8, mode='r+', shape=shape)
+    try:
+        with led._offscreen():
+            for idx in range(lo, hi):
+                led._render(make_frame(led, idx), frames[idx], blend_mode)
+        if fname is not None:
+            frames.flush()
+    finally:
+        del frames
+        if shm is not None:
+            shm.close()
+
+
+class FrameSequence(object):
+    """Frames pre-encoded for playback with DotStrip.send_frame
+
+    Parameters
+    ----------
+    led : instance of DotStrip
+        Parent LED. Frames are encoded with its gamma and length.
+    frames : list
+        One entry per frame: an N x 4 array of RGBA colors for the whole
+        strip, a shape, or a list of shapes drawn on a blank strip.
+    blend_mode : str
+        How shapes within a frame are drawn, as in ``_LightShape.draw``.
+    fname : str | None
+        If not None, frames are stored in a ``np.memmap`` backed by this
+        file instead of in memory.
+    Returns
+    -------
+    frames : instance of FrameSequence
+        The frame sequence object.
+    """
+
+    def __init__(self, led, frames, blend_mode='add', fname=None):
+        shape = (len(frames), len(led._buffer))
+        if fname is None:
+            self._frames = np.zeros(shape, dtype=np.uint8)
+        else:
+            self._frames = np.memmap(fname, dtype=np.uint8, mode='w+',
+                                     shape=shape)
+        with led._offscreen():
+            for frame, out in zip(frames, self._frames):
+                led._render(frame, out, blend_mode)
+        if fname is not None:
+            self._frames.flush()
+        self._fname = fname
+
+
+    @classmethod
+    def render(cls, led, make_frame, n_frames, blend_mode='add', fname=None,
+               n_jobs=None):
+        """Make and encode frames in parallel worker processes
+
+        Workers encode straight into shared memory, or into the
+        ``np.memmap`` if fname is given, so frames are never pickled.
+
+        Parameters
+        ----------
+        led : instance of DotStrip
+            Parent LED. Each worker draws on its own copy of it.
+        make_frame : callable
+            ``make_frame(led, idx)`` returns frame idx in any form taken by
+            FrameSequence, with shapes made on the led passed to it. It is
+            called in the workers, so must be picklable, e.g. a function
+            defined at module level.
+        n_frames : int
+            Number of frames.
         blend_mode : str
-            How to draw new object in relation to other objects
-            'add' : add translucent object on top of existing objects
-            'max' : show whichever object is brighter
-            'occlude' : add opaque object on top of existing objects
+            How shapes within a frame are drawn, as in ``_LightShape.draw``.
+        fname : str | None
+            If not None, frames are stored in a ``np.memmap`` backed by this
+            file instead of in memory.
+        n_jobs : int | None
+            Number of worker processes. If None, one per CPU. If 1, frames
+            are made in this process.
+        Returns
+        -------
+        frames : instance of FrameSequence
+            The frame sequence object.
+        """
+        if n_jobs is None:
+            n_jobs = os.cpu_count() or 1
+        if n_jobs < 1:
+            raise ValueError('n_jobs must be at least 1')
+        shape = (n_frames, len(led._buffer))
+        if fname is None:
+            shm = shared_memory.SharedMemory(
+                create=True, size=max(n_frames * shape[1], 1))
+        else:
+            shm = None
+            np.memmap(fname, dtype=np.uint8, mode='w+', shape=shape).flush()
+        self = cls.__new__(cls)
+        try:
+            # several chunks per worker even out uneven frame costs
+            bounds = np.linspace(0, n_frames, 4 * n_jobs + 1).astype(int)
+            chunks = [(led, make_frame, blend_mode, shape,
+                       None if shm is None else shm.name, fname, lo, hi)
+                      for lo, hi in zip(bounds[:-1].tolist(),
+                                        bounds[1:].tolist()) if hi > lo]
+            if n_jobs == 1:
+                for chunk in chunks:
+                    _render_chunk(*chunk)
+            else:
+                with ProcessPoolExecutor(n_jobs) as pool:
+                    for future in [pool.submit(_render_chunk, *chunk)
+                                   for chunk in chunks]:
+                        future.result()
+            if shm is None:
+                self._frames = np.memmap(fname, dtype=np.uint8, mode='r+',
+                                         shape=shape)
+            else:
+                self._frames = np.ndarray(shape, dtype=np.uint8,
+                                          buffer=shm.buf).copy()
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._fname = fname
+        return self
+
+
+    @classmethod
+    def load(cls, led, fname):
+        """Open frames previously saved with ``fname``, without reading them
+
+        Parameters
+        ----------
+        led : instance of DotStrip
+            LED the frames were encoded for.
+        fname : str
+            File passed as ``fname`` when the frames were made.
+        Returns
+        -------
+        frames : instance of FrameSequence
+            The frame sequence object.
         """
+        self = cls.__new__(cls)
+        self._frames = np.memmap(fname, dtype=np.uint8, mode='r')
+        if len(self._frames) % len(led._buffer):
+            raise ValueError('File does not hold frames for this strip')
+        self._frames = self._frames.reshape(-1, len(led._buffer))
+        self._fname = fname
+        return self
 
 
-        if blend_mode == 'add':
-            self._led._colors += self._colors
-            if any(self._led._colors.ravel() > 1):
-                logger.warning('Buffer values exceed 1. '
-                               'Color distortion may occur.')
-        if blend_mode == 'max':
-            inds = np.where([dat > col for dat, col
-                             in zip(self._colors[:, -1],
-                                    self._led._colors[:, -1])])
-            self._led._colors[inds] = self._colors[inds]
-        if blend_mode == 'occlude':
-            self._led._colors[self._colors[:, -1] > 0] = \
-                self._colors[self._colors[:, -1] > 0]
-        
-        self._led._buffer = \
-            self._led._make_bytes(np.minimum(1, self._led._colors))
-        self._led._pre_buffer = np.zeros((self._led._pre_buffer.shape))
\ No newline at end of file
+    def __len__(self):
+        return len(self._frames)
+
+
+    def __getitem__(self, idx):
+        return self._frames[idx]
+
+
+class Player(object):
+    """Play frames on a DotStrip at a fixed rate from a background thread
+
+    Each frame is due at an absolute deadline counted from ``start``, so a
+    slow frame does not delay the ones after it. The player thread sleeps
+    until each deadline, leaving the calling thread free.
+
+    Parameters
+    ----------
+    led : instance of DotStrip
+        LED to play on. Nothing else should send on it while playing.
+    frames : instance of FrameSequence | FrameLog | list
+        Frames to play. A list is encoded first with FrameSequence.
+    rate : float
+        Frames per second.
+    policy : str
+        What to do when frames fall behind their deadlines.
+        'drop' : skip ahead to the frame due now
+        'catch_up' : send the late frames back to back until on time
+    loop : bool
+        If True, play until stopped, starting over after the last frame.
+    blend_mode : str
+        How shapes within a frame are drawn, when frames is a list.
+    tolerance : float | None
+        Seconds a send may start after its deadline before it counts as
+        missed. If None, half a frame period.
+    history : int
+        Number of most recent send latenesses kept for ``stats``.
+    """
+
+    def __init__(self, led, frames, rate, policy='drop', loop=False,
+                 blend_mode='add', tolerance=None, history=1000):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        if policy not in ('drop', 'catch_up'):
+            raise ValueError('policy must be "drop" or "catch_up"')
+        _check_blocking(led, 'Player')
+        if isinstance(frames, (list, tuple)):
+            frames = FrameSequence(led, frames, blend_mode)
+        if not len(frames):
+            raise ValueError('No frames to play')
+        self._led = led
+        self._frames = frames
+        self._period = 1. / rate
+        self._policy = policy
+        self._loop = loop
+        self._tolerance = (self._period / 2. if tolerance is None
+                           else tolerance)
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+        self.lateness = deque(maxlen=history)
+        self.n_sent = 0
+        self.n_missed = 0
+        self.n_skipped = 0
+
+
+    def start(self):
+        """Start playing from the first frame"""
+        if self.is_playing:
+            raise RuntimeError('Player is already playing')
+        self._stop.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='Player',
+                                        daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        """Stop playing after the frame being sent"""
+        self._stop.set()
+        self.wait()
+
+
+    def wait(self, timeout=None):
+        """Wait for playback to finish
+
+        Parameters
+        ----------
+        timeout : float | None
+            Longest time to wait in seconds. If None, wait until done.
+
+        Returns
+        -------
+        done : bool
+            True if playback has finished.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        return not self.is_playing
+
+
+    @property
+    def is_playing(self):
+        """Whether the player thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+
+    def _run(self):
+        n_frames = len(self._frames)
+        idx = 0
+        t0 = time.monotonic()
+        while self._loop or idx < n_frames:
+            deadline = t0 + idx * self._period
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                self._stop.wait(wait)
+            if self._stop.is_set():
+                return
+            late = time.monotonic() - deadline
+            if self._policy == 'drop' and late >= self._period:
+                skip = int(late // self._period)
+                if not self._loop:
+                    # the last frame is always shown
+                    skip = min(skip, n_frames - 1 - idx)
+                idx += skip
+                late -= skip * self._period
+                self.n_skipped += skip
+            try:
+                self._led.send_frame(self._frames, idx % n_frames)
+            except Exception as exc:
+                self._error = exc
+                return
+            self.lateness.append(late)
+            self.n_missed += late > self._tolerance
+            self.n_sent += 1
+            idx += 1
+
+
+    def stats(self):
+        """Summarize how well playback kept to its deadlines
+
+        Returns
+        -------
+        stats : dict
+            'n_sent', 'n_missed' (sent later than the tolerance) and
+            'n_skipped' (dropped by the 'drop' policy) frames, and the mean,
+            p99 and max 'lateness' in seconds of the recent sends.
+        """
+        late = np.array(self.lateness)
+        stats = dict(n_sent=self.n_sent, n_missed=self.n_missed,
+                     n_skipped=self.n_skipped)
+        stats['lateness'] = dict(mean=late.mean(),
+                                 p99=np.percentile(late, 99),
+                                 max=late.max()) if len(late) else dict()
+        return stats
+
+
+class FrameLog(object):
+    """Frames recorded with DotStrip.start_recording
+
+    Frames are read from the file on access, in any order. Like a
+    FrameSequence, a log can be played with ``DotStrip.send_frame`` or
+    Player.
+
+    Parameters
+    ----------
+    fname : str
+        The recorded file.
+
+    Attributes
+    ----------
+    n_leds : int
+        Number of LEDs of the strip that sent the frames.
+    times : array
+        ``time.monotonic`` time each frame was sent.
+    """
+
+    def __init__(self, fname):
+        header = np.fromfile(fname, dtype=_LOG_HEADER, count=1)
+        if len(header) != 1 or header['magic'][0] != _LOG_MAGIC:
+            raise ValueError('%s is not a frame log' % fname)
+        self.n_leds = int(header['n_leds'][0])
+        n_frames = int(header['n_frames'][0])
+        record = _log_record(int(header['frame_bytes'][0]))
+        if n_frames:
+            self._records = np.memmap(fname, dtype=record, mode='r',
+                                      offset=_LOG_HEADER.itemsize,
+                                      shape=(n_frames,))
+        else:
+            self._records = np.zeros(0, dtype=record)
+        self.times = np.array(self._records['time'])
+        self._fname = fname
+
+
+    def __len__(self):
+        return len(self._records)
+
+
+    def __getitem__(self, idx):
+        return self._records['frame'][idx]
+
+
+    def replay(self, led, realtime=True):
+        """Send the recorded frames again
+
+        Parameters
+        ----------
+        led : instance of DotStrip
+            Strip with the recorded number of LEDs, whose client the frames
+            are sent to.
+        realtime : bool
+            If True, keep the recorded times between frames. If False, send
+            them as fast as possible.
+        """
+        _check_blocking(led, 'FrameLog.replay')
+        t0 = time.monotonic()
+        for idx in range(len(self)):
+            if realtime:
+                wait = t0 + self.times[idx] - self.times[0] - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            led.send_frame(self, idx)
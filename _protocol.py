@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Wire formats shared by DotStrip and the receiver stand-ins.
+
+UDP segments start with a header of frame number, segment index and
+number of segments in the frame, followed by that segment's bytes.
+"""
+from functools import lru_cache
+import struct
+import zlib
+
+import numpy as np
+
+SEGMENT_HEADER = struct.Struct('!IHH')
+
+
+def iter_segments(frame, frame_num, packet_size):
+    """Split a frame into (header, payload) pairs of at most packet_size"""
+    frame = memoryview(frame).cast('B')
+    n_segments = max(-(-len(frame) // packet_size), 1)
+    if n_segments > 0xFFFF:
+        raise ValueError('Frame needs too many segments, '
+                         'increase packet_size')
+    for seg in range(n_segments):
+        header = SEGMENT_HEADER.pack(frame_num & 0xFFFFFFFF, seg, n_segments)
+        yield header, frame[seg * packet_size:(seg + 1) * packet_size]
+
+
+def frame_bytes(n_leds):
+    """Length of an encoded APA102 frame for n_leds"""
+    return 4 + 4 * n_leds + int(np.ceil((n_leds / 2. + 1) / 8.))
+
+
+def frame_leds(n_bytes):
+    """Number of LEDs in an encoded APA102 frame of n_bytes"""
+    # the end frame is under 1/16 of the pixel bytes, so this is close
+    guess = int((n_bytes - 4) / 4.0625)
+    for n_leds in range(max(guess - 1, 0), guess + 2):
+        if frame_bytes(n_leds) == n_bytes:
+            return n_leds
+    raise ValueError('No number of LEDs gives a %d byte frame' % n_bytes)
+
+
+@lru_cache(maxsize=8)
+def dark_frame(n_leds):
+    """Encoded frame with every LED off, read-only"""
+    frame = np.zeros(frame_bytes(n_leds), dtype=np.uint8)
+    frame[4:4 + 4 * n_leds:4] = 0xE0
+    frame.flags.writeable = False
+    return frame
+
+
+# Framed messages, used when frames are sent as deltas or compressed: a
+# header of message kind, frame number and payload length. A keyframe
+# payload is the whole encoded frame. A delta payload is a series of runs,
+# each an offset and length into the frame followed by that many new bytes.
+# Compressed keyframes are either the number of LEDs then the runs that
+# differ from the dark frame, or the frame compressed with zlib.
+MESSAGE_HEADER = struct.Struct('!BII')
+RUN_HEADER = struct.Struct('!II')
+LEDS_HEADER = struct.Struct('!I')
+KEYFRAME = 0
+DELTA = 1
+KEYFRAME_RLE = 2
+KEYFRAME_ZLIB = 3
+COMPRESSIONS = ('rle', 'zlib')
+
+
+def _pack_runs(frame, last):
+    """Runs where frame differs from last, merging those closer than a header
+    """
+    changed = np.flatnonzero(frame != last)
+    parts = []
+    if len(changed):
+        breaks = np.flatnonzero(np.diff(changed) > RUN_HEADER.size)
+        starts = changed[np.concatenate(([0], breaks + 1))]
+        stops = changed[np.concatenate((breaks, [len(changed) - 1]))] + 1
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            parts.append(RUN_HEADER.pack(start, stop - start))
+            parts.append(frame[start:stop].tobytes())
+    return parts
+
+
+def _pack_message(kind, frame_num, parts):
+    n_bytes = sum(len(part) for part in parts)
+    return b''.join([MESSAGE_HEADER.pack(kind, frame_num & 0xFFFFFFFF,
+                                         n_bytes)] + parts)
+
+
+def pack_keyframe(frame, frame_num, compression=None):
+    """Pack a whole frame as a keyframe message
+
+    Parameters
+    ----------
+    frame : bytes-like
+        The frame to send.
+    frame_num : int
+        Number of this frame.
+    compression : str | None
+        'rle' to send only the runs of LEDs that are not dark, or 'zlib' to
+        deflate the frame at level 1. Either is only used when it makes the
+        message smaller.
+
+    Returns
+    -------
+    message : bytes
+        The keyframe message.
+    """
+    frame = memoryview(frame).cast('B')
+    if compression == 'rle':
+        n_leds = frame_leds(len(frame))
+        packed = _pack_message(
+            KEYFRAME_RLE, frame_num,
+            [LEDS_HEADER.pack(n_leds)] +
+            _pack_runs(np.frombuffer(frame, dtype=np.uint8),
+                       dark_frame(n_leds)))
+    elif compression == 'zlib':
+        packed = _pack_message(KEYFRAME_ZLIB, frame_num,
+                               [zlib.compress(frame, 1)])
+    elif compression is not None:
+        raise ValueError('compression must be one of %s or None, got %r'
+                         % (COMPRESSIONS, compression))
+    if (compression is not None and
+            len(packed) < MESSAGE_HEADER.size + len(frame)):
+        return packed
+    return _pack_message(KEYFRAME, frame_num, [frame])
+
+
+def pack_delta(frame, last, frame_num):
+    """Pack the byte runs where frame differs from last as a delta message
+
+    Runs separated by fewer unchanged bytes than a run header are merged.
+
+    Parameters
+    ----------
+    frame : array of uint8
+        The frame to send.
+    last : array of uint8
+        The frame the receiver currently holds, of the same length.
+    frame_num : int
+        Number of this frame.
+
+    Returns
+    -------
+    message : bytes
+        The delta message.
+    """
+    return _pack_message(DELTA, frame_num, _pack_runs(frame, last))
+
+
+def unpack_keyframe(kind, payload):
+    """Rebuild the frame of a raw or compressed keyframe payload"""
+    if kind == KEYFRAME:
+        return bytearray(payload)
+    if kind == KEYFRAME_RLE:
+        n_leds, = LEDS_HEADER.unpack_from(payload)
+        frame = bytearray(dark_frame(n_leds))
+        apply_delta(memoryview(payload)[LEDS_HEADER.size:], frame)
+        return frame
+    if kind == KEYFRAME_ZLIB:
+        return bytearray(zlib.decompress(payload))
+    raise ValueError('Message kind %d is not a keyframe' % kind)
+
+
+def apply_delta(payload, frame):
+    """Write the runs of a delta payload into frame, a writable buffer"""
+    payload = memoryview(payload)
+    frame = memoryview(frame).cast('B')
+    pos = 0
+    while pos < len(payload):
+        start, n = RUN_HEADER.unpack_from(payload, pos)
+        pos += RUN_HEADER.size
+        if start + n > len(frame) or pos + n > len(payload):
+            raise ValueError('Delta run does not fit in the frame')
+        frame[start:start + n] = payload[pos:pos + n]
+        pos += n
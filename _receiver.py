@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-ins for the Raspberry Pi end of the link, for testing without it.
+"""
+import socket
+import threading
+import time
+
+import numpy as np
+
+from _protocol import (SEGMENT_HEADER, MESSAGE_HEADER, DELTA, frame_bytes,
+                       frame_leds, unpack_keyframe, apply_delta)
+
+
+def decode_frame(frame, n_leds=None):
+    """Decode an APA102 frame back to colors and global brightness
+
+    Parameters
+    ----------
+    frame : bytes-like
+        A frame as made by ``DotStrip._make_bytes``: a start frame of 4 zero
+        bytes, 4 bytes per LED, then an end frame of zero bytes.
+    n_leds : int | None
+        Expected number of LEDs. If None, it is found from the length.
+
+    Returns
+    -------
+    rgb : array of uint8, shape (n_leds, 3)
+        Red, green and blue of each LED.
+    brightness : array of uint8, shape (n_leds,)
+        5-bit global brightness of each LED.
+    """
+    frame = np.frombuffer(frame, dtype=np.uint8)
+    if n_leds is None:
+        n_leds = frame_leds(len(frame))
+    if frame_bytes(n_leds) != len(frame):
+        raise ValueError('Frame of %d bytes does not fit %d LEDs'
+                         % (len(frame), n_leds))
+    pixels = frame[4:4 + 4 * n_leds].reshape(n_leds, 4)
+    if frame[:4].any():
+        raise ValueError('Start frame is not zero')
+    if np.any(pixels[:, 0] < 0xE0):
+        raise ValueError('Pixel %d does not start with 0b111'
+                         % np.flatnonzero(pixels[:, 0] < 0xE0)[0])
+    if frame[4 + 4 * n_leds:].any():
+        raise ValueError('End frame is not zero')
+    return pixels[:, :0:-1].copy(), pixels[:, 0] & 0x1F
+
+
+class _FrameStats(object):
+    """Checks and summaries of the frames a receiver collected"""
+
+    def decoded(self, n_leds=None):
+        """Decode each frame received, with None for malformed frames
+
+        Parameters
+        ----------
+        n_leds : int | None
+            Expected number of LEDs. If None, it is found from each frame.
+
+        Returns
+        -------
+        decoded : list of (rgb, brightness) | None
+            Output of ``decode_frame`` for each frame.
+        """
+        decoded = []
+        for _, frame in self.frames:
+            try:
+                decoded.append(decode_frame(frame, n_leds))
+            except ValueError:
+                decoded.append(None)
+        return decoded
+
+
+    def stats(self, send_times=None, n_leds=None):
+        """Summarize what arrived
+
+        Parameters
+        ----------
+        send_times : array | None
+            ``time.perf_counter`` time each frame was sent, indexed by frame
+            number, e.g. the 'time' passed to the ``DotStrip.start_timing``
+            callback. Needed for latency.
+        n_leds : int | None
+            Expected number of LEDs, as for ``decoded``.
+
+        Returns
+        -------
+        stats : dict
+            'n_frames' received, 'n_malformed' that did not decode,
+            'n_dropped' numbered before the last arrival that never came,
+            'bytes_per_sec' and 'frames_per_sec' between the first and last
+            arrival, and the mean, p50, p99 and max 'latency' from send to
+            arrival in seconds.
+        """
+        times = np.array([t for t, _ in self.frames])
+        n_bytes = sum(len(frame) for _, frame in self.frames)
+        stats = dict(n_frames=len(times),
+                     n_malformed=sum(d is None for d in self.decoded(n_leds)),
+                     n_dropped=(self.frame_nums[-1] + 1 - len(times)
+                                if len(times) else 0))
+        span = times[-1] - times[0] if len(times) > 1 else 0.
+        stats['bytes_per_sec'] = n_bytes / span if span > 0 else 0.
+        stats['frames_per_sec'] = (len(times) - 1) / span if span > 0 else 0.
+        stats['latency'] = dict()
+        if send_times is not None and len(times):
+            latency = times - np.asarray(send_times)[self.frame_nums]
+            stats['latency'] = dict(mean=latency.mean(),
+                                    p50=np.percentile(latency, 50),
+                                    p99=np.percentile(latency, 99),
+                                    max=latency.max())
+        return stats
+
+
+class SegmentAssembler(object):
+    """Rebuild frames from UDP segments, dropping incomplete frames
+
+    A frame is dropped when a segment of a newer frame arrives before all
+    of its own segments. Segments of frames older than the one being
+    assembled are ignored.
+    """
+
+    def __init__(self):
+        self._frame_num = None
+        self._parts = dict()
+        # number of the last complete frame
+        self.frame_num = None
+        self.n_frames = 0
+        self.n_dropped = 0
+
+
+    def add(self, packet):
+        """Add one packet, returning the frame bytes once it is complete"""
+        frame_num, seg, n_segments = SEGMENT_HEADER.unpack_from(packet)
+        if frame_num != self._frame_num:
+            if self._frame_num is not None and frame_num < self._frame_num:
+                return None
+            if self._parts:
+                self.n_dropped += 1
+            self._frame_num = frame_num
+            self._parts = dict()
+        self._parts[seg] = bytes(packet[SEGMENT_HEADER.size:])
+        if len(self._parts) < n_segments:
+            return None
+        frame = b''.join(self._parts[ii] for ii in range(n_segments))
+        self._parts = dict()
+        self.frame_num = frame_num
+        self.n_frames += 1
+        return frame
+
+
+class MessageDecoder(object):
+    """Rebuild frames from keyframe and delta messages
+
+    Keyframes may be raw or compressed. A delta is only applied on top of
+    the frame numbered just before it. After a lost message, deltas are
+    dropped until the next keyframe.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.frame_num = None
+        self.n_frames = 0
+        self.n_dropped = 0
+
+
+    def decode(self, message):
+        """Decode one message, returning the frame bytes or None if dropped"""
+        message = memoryview(message)
+        kind, frame_num, n_bytes = MESSAGE_HEADER.unpack_from(message)
+        payload = message[MESSAGE_HEADER.size:]
+        if len(payload) != n_bytes:
+            raise ValueError('Message payload is %d bytes, header says %d'
+                             % (len(payload), n_bytes))
+        if kind == DELTA:
+            if (self.frame is None or
+                    frame_num != (self.frame_num + 1) & 0xFFFFFFFF):
+                self.n_dropped += 1
+                return None
+            apply_delta(payload, self.frame)
+        else:
+            self.frame = unpack_keyframe(kind, payload)
+        self.frame_num = frame_num
+        self.n_frames += 1
+        return bytes(self.frame)
+
+
+def _recv_exactly(conn, n_bytes):
+    """Read n_bytes from a stream socket, or None if it closes first"""
+    buf = bytearray(n_bytes)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n_bytes:
+        n = conn.recv_into(view[pos:])
+        if not n:
+            return None
+        pos += n
+    return buf
+
+
+class TCPReceiver(threading.Thread, _FrameStats):
+    """Receive frames on a localhost TCP port
+
+    Parameters
+    ----------
+    frame_bytes : int | None
+        Length of a raw encoded frame, ``len(DotStrip.buffer)``. Used when
+        ``framed`` is False.
+    framed : bool
+        If True, read keyframe and delta messages instead of raw frames.
+    port : int
+        Port to listen on. 0 picks a free port, see ``address``.
+
+    Attributes
+    ----------
+    frames : list of (float, bytes)
+        Arrival time from ``time.perf_counter`` and bytes of each frame.
+    frame_nums : list of int
+        Number of each frame, counted by the sending strip.
+    """
+
+    def __init__(self, frame_bytes=None, framed=False, port=0):
+        threading.Thread.__init__(self, name='TCPReceiver', daemon=True)
+        if not framed and frame_bytes is None:
+            raise ValueError('frame_bytes is needed to read raw frames')
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', port))
+        self._server.listen(1)
+        self._frame_bytes = frame_bytes
+        self.address = self._server.getsockname()
+        self.decoder = MessageDecoder() if framed else None
+        self.frames = []
+        self.frame_nums = []
+
+
+    def _read(self, conn):
+        if self.decoder is None:
+            return _recv_exactly(conn, self._frame_bytes)
+        header = _recv_exactly(conn, MESSAGE_HEADER.size)
+        if header is None:
+            return None
+        payload = _recv_exactly(conn, MESSAGE_HEADER.unpack(header)[2])
+        return None if payload is None else header + payload
+
+
+    def run(self):
+        conn, _ = self._server.accept()
+        with conn:
+            while True:
+                data = self._read(conn)
+                if data is None:
+                    break
+                now = time.perf_counter()
+                if self.decoder is not None:
+                    data = self.decoder.decode(data)
+                if data is not None:
+                    self.frames.append((now, bytes(data)))
+                    self.frame_nums.append(len(self.frame_nums)
+                                           if self.decoder is None
+                                           else self.decoder.frame_num)
+        self._server.close()
+
+
+    def connect(self):
+        """Start receiving and return a TCP client connected to us"""
+        self.start()
+        client = socket.create_connection(self.address)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return client
+
+
+    def close(self):
+        """Wait for the client to disconnect"""
+        self.join()
+
+
+class UDPReceiver(threading.Thread, _FrameStats):
+    """Receive segmented frames on a localhost UDP port
+
+    Parameters
+    ----------
+    framed : bool
+        If True, reassembled frames are keyframe and delta messages.
+    port : int
+        Port to listen on. 0 picks a free port, see ``address``.
+    max_packet : int
+        Largest datagram accepted.
+
+    Attributes
+    ----------
+    frames : list of (float, bytes)
+        Arrival time from ``time.perf_counter`` and bytes of each frame.
+    frame_nums : list of int
+        Number of each frame, from the segment headers.
+    """
+
+    def __init__(self, framed=False, port=0, max_packet=65536):
+        threading.Thread.__init__(self, name='UDPReceiver', daemon=True)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', port))
+        self._sock.settimeout(0.1)
+        self._max_packet = max_packet
+        self._running = True
+        self.address = self._sock.getsockname()
+        self.assembler = SegmentAssembler()
+        self.decoder = MessageDecoder() if framed else None
+        self.frames = []
+        self.frame_nums = []
+
+
+    def run(self):
+        buf = bytearray(self._max_packet)
+        view = memoryview(buf)
+        while True:
+            try:
+                n = self._sock.recv_into(buf)
+            except socket.timeout:
+                # packets still queued when closed are read before stopping
+                if not self._running:
+                    break
+                continue
+            frame = self.assembler.add(view[:n])
+            if frame is not None and self.decoder is not None:
+                frame = self.decoder.decode(frame)
+            if frame is not None:
+                self.frames.append((time.perf_counter(), frame))
+                self.frame_nums.append(self.assembler.frame_num)
+        self._sock.close()
+
+
+    def connect(self):
+        """Start receiving and return a UDP client connected to us"""
+        self.start()
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.connect(self.address)
+        return client
+
+
+    def close(self):
+        self._running = False
+        self.join()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for encoding, compositing and sending LED frames.
+
+Runs without the Raspberry Pi: frames go to an in-process fake socket or to
+receiver threads on localhost TCP and UDP. Usage:
+
+    python led_bench.py --sizes 100 1000 10000 100000 --output bench_output.txt
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from _blend import BLEND_MODES
+from _led import DotStrip, Line
+from _receiver import UDPReceiver
+
+
+class FakeSocket(object):
+    """Stand-in client that accepts frames without any I/O"""
+
+    def __init__(self):
+        self.n_bytes = 0
+
+    def sendall(self, data):
+        self.n_bytes += memoryview(data).nbytes
+
+
+class LocalReceiver(threading.Thread):
+    """TCP server on localhost that reads and discards everything sent"""
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.address = self._server.getsockname()
+        self.n_bytes = 0
+
+    def run(self):
+        conn, _ = self._server.accept()
+        buf = bytearray(1 << 16)
+        with conn:
+            while True:
+                n = conn.recv_into(buf)
+                if not n:
+                    break
+                self.n_bytes += n
+        self._server.close()
+
+    def connect(self):
+        self.start()
+        client = socket.create_connection(self.address)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return client
+
+
+def time_calls(func, n_frames, setup=None):
+    """Time func once per frame, returning the per-frame times in seconds"""
+    times = np.zeros(n_frames)
+    for ii in range(n_frames):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        times[ii] = time.perf_counter() - t0
+    return times
+
+
+def peak_memory(func, setup=None):
+    """Peak bytes allocated by python during one call of func"""
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(name, n_leds, times, peak):
+    p50, p90, p99 = np.percentile(times, [50, 90, 99]) * 1e3
+    return ('%-18s %8d %10.1f %9.3f %9.3f %9.3f %10.1f'
+            % (name, n_leds, len(times) / times.sum(), p50, p90, p99,
+               peak / 1024.))
+
+
+def run_size(n_leds, n_frames, tcp=True):
+    fake = FakeSocket()
+    led = DotStrip(fake, n_leds, deferred=True)
+    rng = np.random.RandomState(0)
+    colors = rng.rand(n_leds, 4) * .4
+    line = Line(None, led, [.5, .4, .3, .6],
+                [n_leds // 4, n_leds // 4 + max(n_leds // 10, 1)])
+
+    def encode():
+        led._make_bytes(colors)
+
+    def reset():
+        led._colors[:] = colors
+
+    rows = [summarize('encode', n_leds, time_calls(encode, n_frames),
+                      peak_memory(encode))]
+    for mode in BLEND_MODES:
+        def draw():
+            line.draw(mode)
+        rows.append(summarize('draw-' + mode, n_leds,
+                              time_calls(draw, n_frames, reset),
+                              peak_memory(draw, reset)))
+
+    def send():
+        led.mark_dirty()
+        led.send()
+    rows.append(summarize('encode+send-fake', n_leds,
+                          time_calls(send, n_frames), peak_memory(send)))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        led.start_recording(os.path.join(tmpdir, 'bench.ledlog'),
+                            capacity=n_frames + 1)
+        try:
+            rows.append(summarize('encode+send-record', n_leds,
+                                  time_calls(send, n_frames),
+                                  peak_memory(send)))
+        finally:
+            led.stop_recording()
+    if tcp:
+        receiver = LocalReceiver()
+        led._client = receiver.connect()
+        try:
+            rows.append(summarize('encode+send-tcp', n_leds,
+                                  time_calls(send, n_frames),
+                                  peak_memory(send)))
+        finally:
+            led._client.close()
+            receiver.join()
+        receiver = UDPReceiver()
+        led._client = receiver.connect()
+        led._tcp = False
+        try:
+            rows.append(summarize('encode+send-udp', n_leds,
+                                  time_calls(send, n_frames),
+                                  peak_memory(send)))
+        finally:
+            led._client.close()
+            receiver.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000, 100000])
+    parser.add_argument('--frames', type=int, default=200,
+                        help='frames timed per benchmark')
+    parser.add_argument('--no-tcp', action='store_true',
+                        help='skip the localhost TCP and UDP receivers')
+    parser.add_argument('--output', default=None,
+                        help='also write the results to this file')
+    args = parser.parse_args()
+
+    lines = ['%-18s %8s %10s %9s %9s %9s %10s'
+             % ('benchmark', 'n_leds', 'fps', 'p50 ms', 'p90 ms', 'p99 ms',
+                'peak KiB')]
+    print(lines[0])
+    for n_leds in args.sizes:
+        for row in run_size(n_leds, args.frames, not args.no_tcp):
+            print(row)
+            lines.append(row)
+    if args.output is not None:
+        with open(args.output, 'w') as fid:
+            fid.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    main()
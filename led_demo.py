@@ -4,7 +4,8 @@ Created on Fri May 31 10:37:22 2019
 
 @author: mcappelloni
 """
-from _led import (DotStrip, _LightShape, Dot, Line, Gaussian, Tukey, PixelArray)
+from _led import (DotStrip, _LightShape, Dot, Line, Gaussian, Tukey, PixelArray,
+                  FrameSequence, Player)
 import argparse
 import numpy as np 
 from pythonosc import udp_client, osc_bundle_builder
@@ -20,7 +21,7 @@ PORT = 5005        # The port used by the server
 client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 client.connect((HOST, PORT))
 
-dots = DotStrip(client, n_led)
+dots = DotStrip(client, n_led, deferred=True)
 modes = ['Full Rainbow', 'Gradient', 'Model Train', 'Cylon', 'Noise']
 
 with ExperimentController('test_led', output_dir=None, version='dev', 
@@ -45,37 +46,30 @@ with ExperimentController('test_led', output_dir=None, version='dev',
     colors = cm(np.linspace(0, 1, n_led // 2, dtype=float))
     colors = np.concatenate((colors, np.flipud(colors)), 0)
     colors[:, -1] *= .3
-    gradient = [PixelArray(ec, dots, np.roll(colors, shift, 0), [0, n_led - 1]) for shift in np.arange(0, 1109, 5)]
+    gradient = PixelArray.from_frames(ec, dots, [np.roll(colors, shift, 0) for shift in np.arange(0, 1109, 5)], [0, n_led - 1])
     cm = plt.get_cmap('gray')
     colors = cm(np.linspace(0, 1, 20, dtype=float))
     colors[:, -1] *= .5
     model_train = [[Dot(ec, dots, c, (x + shift) % n_led) for shift, c in enumerate(colors)] for x in range(n_led - 1)]
     colors = np.random.rand(100, 1109, 4)
     colors[:, :, -1] = .2
-#    noise = [PixelArray(ec, dots, c, [0, n_led - 1]) for c in colors]
-    noise = 0
-    all_stim = [full_rainbow, gradient, model_train, cylon, noise]
+    noise = PixelArray.from_frames(ec, dots, colors, [0, n_led - 1])
+    all_stim = [FrameSequence(dots, stim, 'occlude') for stim in
+                [full_rainbow, gradient, model_train, cylon, noise]]
     ec.listen_presses()
     ec.screen_text(instructions)
     ec.flip()
-    start = ec.current_time
     while int(pressed) != 6:
-        i = int(pressed) - 1
-        stim = all_stim[i]
-        for s in stim:
-            if type(s) == list:
-                [ss.draw() for ss in s]
-            else:
-                s.draw('occlude')
-            ec.wait_until(start + .01)
-            dots.send()
-            start = ec.current_time
-            dots.clear_strip()
+        player = Player(dots, all_stim[int(pressed) - 1], rate=100., loop=True)
+        player.start()
+        change = None
+        while not change:
+            ec.wait_secs(.05)
             change = ec.get_presses(timestamp=False)
-            if change:
-                pressed = change[0][0]
-            ec.listen_presses()
-            
+        player.stop()
+        pressed = change[0][0]
+        ec.listen_presses()
+
     dots.clear_strip()
     dots.send()
     ec.wait_secs(1)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Check frames end to end through localhost receivers that stand in for the Pi.
+
+The encoder is first checked against a frozen reference frame, and the
+segment and message formats are round-tripped without sockets. Moving
+shapes are then drawn and sent over TCP and UDP, raw, as deltas and
+compressed. Every frame that arrives is decoded and compared with what was
+sent. Exits with status 1 on any mismatch, malformed or missing frame.
+Usage:
+
+    python led_loopback.py --n-leds 10000 --frames 500
+"""
+import argparse
+import sys
+
+from _led import DotStrip, Gaussian, Line
+from _protocol import COMPRESSIONS, iter_segments, pack_delta, pack_keyframe
+from _receiver import (MessageDecoder, SegmentAssembler, TCPReceiver,
+                       UDPReceiver, decode_frame, frame_bytes)
+
+# 12 LEDs holding the shapes drawn by _draw(led, 12, 0), as encoded before the
+# encoder was vectorized
+REFERENCE_FRAME = bytes.fromhex(
+    '00000000e0000000e1000002e2000006e5000007e6000008e5000007'
+    'e4080001e4070000e4070000e4070000e0000000e000000000')
+
+
+def _draw(led, n_leds, ii):
+    led.clear_strip()
+    Gaussian(None, led, [.8, .3, .1, .7], (7 * ii + 4) % n_leds,
+             max(n_leds // 50, 2)).draw()
+    Line(None, led, [.1, .2, .9, .5],
+         [(ii + 6) % n_leds, min((ii + 6) % n_leds + 4, n_leds)]).draw('over')
+
+
+def check_wire_formats(n_frames=20):
+    """Check the encoder and wire formats without sockets
+
+    Returns
+    -------
+    n_bad : int
+        Number of failed checks, each of which is printed.
+    """
+    failed = []
+    led = DotStrip(None, 12)
+    _draw(led, 12, 0)
+    if bytes(led.buffer) != REFERENCE_FRAME:
+        failed.append('encoder differs from the reference frame')
+
+    led = DotStrip(None, 300)
+    frames = []
+    for ii in range(n_frames):
+        _draw(led, 300, ii)
+        frames.append(led.buffer.copy())
+    assembler = SegmentAssembler()
+    for num, frame in enumerate(frames):
+        out = [assembler.add(header + bytes(payload)) for header, payload
+               in iter_segments(frame, num, 100)]
+        if out[-1] != frame.tobytes() or any(o is not None for o in out[:-1]):
+            failed.append('segments of frame %d' % num)
+    for compression in (None,) + COMPRESSIONS:
+        decoder = MessageDecoder()
+        for num, frame in enumerate(frames):
+            if num % 5:
+                message = pack_delta(frame, frames[num - 1], num)
+            else:
+                message = pack_keyframe(frame, num, compression)
+            if decoder.decode(message) != frame.tobytes():
+                failed.append('messages of frame %d with %s keyframes'
+                              % (num, compression or 'raw'))
+    for check in failed:
+        print('FAILED: %s' % check)
+    return len(failed)
+
+
+def run(protocol, n_leds, n_frames, keyframe_interval=None, compression=None):
+    framed = keyframe_interval is not None or compression is not None
+    if protocol == 'tcp':
+        receiver = TCPReceiver(frame_bytes(n_leds), framed)
+    else:
+        receiver = UDPReceiver(framed=framed)
+    client = receiver.connect()
+    led = DotStrip(client, n_leds, protocol=protocol,
+                   keyframe_interval=keyframe_interval,
+                   compression=compression)
+    send_times = []
+    led.start_timing(n_frames, lambda row: send_times.append(row['time']))
+    sent = []
+    try:
+        for ii in range(n_frames):
+            _draw(led, n_leds, ii)
+            led.send()
+            sent.append(bytes(led.buffer))
+    finally:
+        client.close()
+        receiver.close()
+    n_bad = 0
+    for num, decoded in zip(receiver.frame_nums, receiver.decoded(n_leds)):
+        if decoded is None or any((a != b).any() for a, b in
+                                  zip(decoded, decode_frame(sent[num]))):
+            n_bad += 1
+    stats = receiver.stats(send_times, n_leds)
+    latency = stats['latency']
+    print('%-14s %8d %8d %8d %8d %10.1f %9.3f %9.3f'
+          % ('-'.join([protocol] +
+                      (['delta'] if keyframe_interval else []) +
+                      ([compression] if compression else [])), n_leds,
+             stats['n_frames'], stats['n_malformed'] + n_bad,
+             stats['n_dropped'], stats['bytes_per_sec'] / 2 ** 20,
+             latency.get('p50', 0) * 1e3, latency.get('p99', 0) * 1e3))
+    # UDP on localhost may still drop a frame under load
+    n_missing = n_frames - stats['n_frames'] if protocol == 'tcp' else 0
+    return stats['n_malformed'] + n_bad + n_missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n-leds', type=int, default=1091)
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+
+    n_bad = check_wire_formats()
+    print('%-14s %8s %8s %8s %8s %10s %9s %9s'
+          % ('link', 'n_leds', 'frames', 'bad', 'dropped', 'MiB/s',
+             'p50 ms', 'p99 ms'))
+    for protocol in ('tcp', 'udp'):
+        for keyframe_interval, compression in ((None, None), (30, None),
+                                               (None, 'rle'), (None, 'zlib'),
+                                               (30, 'rle')):
+            n_bad += run(protocol, args.n_leds, args.frames,
+                         keyframe_interval, compression)
+    sys.exit(1 if n_bad else 0)
+
+
+if __name__ == '__main__':
+    main()
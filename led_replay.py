@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Re-send frames recorded with DotStrip.start_recording.
+
+Frames keep their recorded timing unless --fast is given. Usage:
+
+    python led_replay.py session.ledlog --host 169.254.150.219 --port 5005
+"""
+import argparse
+import socket
+
+from _led import DotStrip, FrameLog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('fname', help='recorded frame log')
+    parser.add_argument('--host', default='169.254.150.219')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--protocol', choices=['tcp', 'udp'], default='tcp')
+    parser.add_argument('--fast', action='store_true',
+                        help='send frames as fast as possible')
+    args = parser.parse_args()
+
+    log = FrameLog(args.fname)
+    if args.protocol == 'tcp':
+        client = socket.create_connection((args.host, args.port))
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.connect((args.host, args.port))
+    with client:
+        led = DotStrip(client, log.n_leds, protocol=args.protocol)
+        log.replay(led, realtime=not args.fast)
+    print('Sent %d frames' % len(log))
+
+
+if __name__ == '__main__':
+    main()